@@ -13,14 +13,38 @@ admin.site.register(models.Wallet, WalletAdmin)
 
 
 class OperationAdmin(admin.ModelAdmin):
-    list_display = ('id', 'wallet', 'balance', 'holded', 'unconfirmed', 'description')
+    list_display = ('id', 'wallet', 'balance', 'holded', 'unconfirmed', 'description', 'reason')
     list_filter = ('wallet',)
 
+    def get_queryset(self, request):
+        return super(OperationAdmin, self).get_queryset(request).with_reasons()
+
 admin.site.register(models.Operation, OperationAdmin)
 
 
+class WalletCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('id', 'wallet', 'operation_id', 'created', 'balance', 'holded', 'unconfirmed', 'total_received')
+    list_filter = ('wallet',)
+
+admin.site.register(models.WalletCheckpoint, WalletCheckpointAdmin)
+
+
+class OperationArchiveAdmin(admin.ModelAdmin):
+    list_display = ('id', 'wallet', 'created', 'balance', 'holded', 'unconfirmed', 'description')
+    list_filter = ('wallet',)
+
+admin.site.register(models.OperationArchive, OperationArchiveAdmin)
+
+
+class OperationSummaryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'wallet', 'period', 'balance', 'holded', 'unconfirmed', 'total_received', 'operations')
+    list_filter = ('wallet',)
+
+admin.site.register(models.OperationSummary, OperationSummaryAdmin)
+
+
 class CurrencyAdmin(admin.ModelAdmin):
-    list_display = ('ticker', 'label', 'last_block')
+    list_display = ('ticker', 'label', 'last_block', 'address_queue', 'address_rate')
 
 admin.site.register(models.Currency, CurrencyAdmin)
 
@@ -1,6 +1,8 @@
 from decimal import Decimal as D
 
-from cc.models import Wallet, Operation, Address, Currency, Transaction, WithdrawTransaction
+from django.db.models import Q, Sum
+
+from cc.models import Wallet, Operation, Address, Currency, Transaction, WithdrawTransaction, CHECKPOINT_FIELDS
 
 
 def total_recieved(ticker, listreceivedbyaddress):
@@ -51,3 +53,38 @@ def double_spend(ticker, listtransactions, ccc):
     return
 
     return result
+
+
+def verify_checkpoints(ticker=None):
+    wallets = Wallet.objects.all()
+    if ticker:
+        wallets = wallets.filter(currency__ticker=ticker)
+
+    result = {'mismatch': []}
+
+    for w in wallets:
+        checkpoint = w.get_checkpoint()
+        if not checkpoint:
+            continue
+
+        totals = Operation.objects.filter(wallet=w, id__lte=checkpoint.operation_id).aggregate(
+            total_received=Sum('balance', filter=Q(balance__gt=0)),
+            balance=Sum('balance'),
+            holded=Sum('holded'),
+            unconfirmed=Sum('unconfirmed'),
+        )
+
+        # Archived operations are only known by their summaries
+        summary = w.get_archive_summary()
+
+        for field in CHECKPOINT_FIELDS:
+            db = (totals[field] or D('0')) + (getattr(summary, field) if summary else D('0'))
+            if db != getattr(checkpoint, field):
+                result['mismatch'].append({
+                    'wallet': w.id,
+                    'field': field,
+                    'db': db,
+                    'checkpoint': getattr(checkpoint, field),
+                })
+
+    return result
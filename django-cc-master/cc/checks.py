@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+
+from django.apps import apps
+from django.conf import settings as django_settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections, router
+
+from . import settings
+from .fields import AmountField
+
+
+def amount_column_mismatches(connection):
+    """``(model, field)`` pairs of amount columns whose type doesn't follow
+    ``CC_INTEGER_AMOUNTS``, tables that don't exist yet are skipped"""
+    expected = 'BigIntegerField' if settings.CC_INTEGER_AMOUNTS else 'DecimalField'
+    introspection = connection.introspection
+    result = []
+    with connection.cursor() as cursor:
+        tables = introspection.table_names(cursor)
+        for model in apps.get_app_config('cc').get_models():
+            fields = [f for f in model._meta.local_concrete_fields if isinstance(f, AmountField)]
+            if not fields or model._meta.db_table not in tables:
+                continue
+
+            columns = dict((c.name, c) for c in introspection.get_table_description(cursor, model._meta.db_table))
+            for field in fields:
+                column = columns.get(field.column)
+                if column is not None and introspection.get_field_type(column.type_code, column) != expected:
+                    result.append((model, field))
+    return result
+
+
+def mismatch_message(model, field):
+    return '%s.%s is not stored as %s.' % (
+        model._meta.db_table, field.column,
+        'BIGINT base units' if settings.CC_INTEGER_AMOUNTS else 'NUMERIC')
+
+
+@checks.register(checks.Tags.database)
+def check_amount_columns(app_configs=None, databases=None, **kwargs):
+    errors = []
+    for alias in databases or []:
+        try:
+            mismatches = amount_column_mismatches(connections[alias])
+        except (DatabaseError, ImproperlyConfigured):
+            # No database to look at, e.g. while building
+            continue
+
+        errors.extend(
+            checks.Error(
+                mismatch_message(model, field),
+                hint='CC_INTEGER_AMOUNTS was changed, run "manage.py convert_amounts".',
+                obj=field,
+                id='cc.E001',
+            )
+            for model, field in mismatches
+        )
+    return errors
+
+
+@checks.register('caches')
+def check_notify_cache(app_configs=None, **kwargs):
+    backend = django_settings.CACHES.get(settings.CC_NOTIFY_CACHE, {}).get('BACKEND', '')
+    if backend.rsplit('.', 1)[-1] not in ('LocMemCache', 'DummyCache'):
+        return []
+    return [
+        checks.Warning(
+            'CC_NOTIFY_CACHE "%s" is not shared between processes.' % settings.CC_NOTIFY_CACHE,
+            hint='blocknotify and walletnotify calls are only coalesced, and early address refills '
+                 'only triggered, within one process. Point it to a shared cache such as Redis or Memcached.',
+            id='cc.W001',
+        )
+    ]
+
+
+_verified = set()
+
+
+def require_amount_columns():
+    """Raise ImproperlyConfigured unless the amount columns follow ``CC_INTEGER_AMOUNTS``.
+
+    Celery workers never run system checks, so tasks that write amounts
+    call this first. A database that passed is checked once per process.
+    """
+    from .models import Wallet
+
+    alias = router.db_for_write(Wallet)
+    if alias in _verified:
+        return
+
+    mismatches = amount_column_mismatches(connections[alias])
+    if mismatches:
+        raise ImproperlyConfigured(' '.join(mismatch_message(model, field) for model, field in mismatches) +
+                                   ' CC_INTEGER_AMOUNTS was changed, run "manage.py convert_amounts".')
+    _verified.add(alias)
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import Value
+
+from . import settings
+
+
+class AmountField(models.DecimalField):
+    """Ledger amount, a Decimal in Python.
+
+    With ``CC_INTEGER_AMOUNTS`` the column is a BIGINT of base units
+    (satoshis for 8 decimal places) and values are only converted when they
+    are written or read.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_digits', 18)
+        kwargs.setdefault('decimal_places', 8)
+        super(AmountField, self).__init__(*args, **kwargs)
+
+    def get_internal_type(self):
+        if settings.CC_INTEGER_AMOUNTS:
+            return 'BigIntegerField'
+        return 'DecimalField'
+
+    def to_units(self, value):
+        value = self.to_python(value)
+        if value is None:
+            return None
+        return int(value.scaleb(self.decimal_places).to_integral_value())
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or not settings.CC_INTEGER_AMOUNTS:
+            return value
+        return Decimal(int(value)).scaleb(-self.decimal_places)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if settings.CC_INTEGER_AMOUNTS:
+            return self.to_units(value)
+        return super(AmountField, self).get_db_prep_value(value, connection, prepared)
+
+    def get_db_prep_save(self, value, connection):
+        if settings.CC_INTEGER_AMOUNTS:
+            return self.to_units(value)
+        return super(AmountField, self).get_db_prep_save(value, connection)
+
+
+def as_amount(value):
+    """Wrap ``value`` for arithmetic with amount columns, e.g. ``F('balance') + as_amount(x)``"""
+    return Value(value, output_field=AmountField())
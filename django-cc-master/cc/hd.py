@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+
+from django.core.exceptions import ValidationError
+from pycoin.encoding.b58 import a2b_hashed_base58, b2a_hashed_base58
+from pycoin.encoding.exceptions import EncodingError
+from pycoin.symbols.btc import network
+
+# Derivation is the same for every coin, only the address prefix differs
+RECEIVE_CHAIN = 0
+
+
+def parse_xpub(xpub):
+    """Return the BIP32 node of an extended public key of any network"""
+    try:
+        data = a2b_hashed_base58(xpub)
+    except EncodingError:
+        raise ValueError('Invalid extended public key')
+
+    if len(data) != 78:
+        raise ValueError('Invalid extended public key')
+    if data[45:46] == b'\0':
+        raise ValueError('Extended private keys must not be stored, use the public one')
+
+    return network.keys.bip32_deserialize(data)
+
+
+def validate_xpub(value):
+    try:
+        parse_xpub(value)
+    except ValueError as e:
+        raise ValidationError(str(e))
+
+
+def derive_addresses(xpub, magicbyte, start, count):
+    """P2PKH addresses ``xpub/0/start`` .. ``xpub/0/start+count-1``.
+
+    ``magicbyte`` is ``Currency.magicbyte``, the first of its bytes is the
+    pubkey hash prefix. Coins with longer prefixes (e.g. Zcash) get invalid
+    addresses, ``check_node`` tells them apart.
+    """
+    prefix = bytes([int(magicbyte.split(',')[0])])
+    chain = parse_xpub(xpub).subkey(RECEIVE_CHAIN)
+    return [b2a_hashed_base58(prefix + chain.subkey(i).hash160()) for i in range(start, start + count)]
+
+
+def check_node(coin, xpub, magicbyte):
+    """Raise ValueError unless the node behind ``coin`` can watch derived addresses.
+
+    The node must accept the derived addresses and have a legacy wallet,
+    descriptor wallets have no ``importmulti``.
+    """
+    if coin.getwalletinfo().get('descriptors'):
+        raise ValueError('Descriptor wallets can\'t import addresses, use a legacy wallet or no xpub')
+
+    address = derive_addresses(xpub, magicbyte, 0, 1)[0]
+    if not coin.validateaddress(address).get('isvalid'):
+        raise ValueError('The node rejects addresses derived with magic byte {0}, '
+                         'this currency can\'t use an xpub'.format(magicbyte.split(',')[0]))
@@ -0,0 +1,93 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from cc import settings, tasks
+from cc.fakenode import FakeNode
+from cc.models import Wallet, Address, Currency
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = 'Measures deposit and withdraw throughput against an in-process fake bitcoind'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticker', type=str, default='BNCH')
+        parser.add_argument('--wallets', type=int, default=100, help='wallets (and deposit addresses) to create')
+        parser.add_argument('--blocks', type=int, default=10, help='blocks with deposits to synthesize')
+        parser.add_argument('--deposits', type=int, default=100, help='deposits per block')
+        parser.add_argument('--withdrawals', type=int, default=100, help='withdraw transactions to create')
+
+    def handle(self, *args, **options):
+        ticker = options['ticker']
+        if Currency.objects.filter(ticker=ticker).exists():
+            raise CommandError('Currency "%s" already exists, pick another --ticker' % ticker)
+
+        node = FakeNode().start()
+        currency = Currency.objects.create(ticker=ticker, label='Benchmark %s' % ticker,
+                                           api_url=node.url, magicbyte='111,196', last_block=0)
+        try:
+            self.run(node, currency, options)
+        finally:
+            currency.delete()
+            node.stop()
+
+    def measure(self, timings, queries, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            start = perf_counter()
+            func(*args, **kwargs)
+            timings.append(perf_counter() - start)
+        queries.append(len(ctx.captured_queries))
+
+    def run(self, node, currency, options):
+        Wallet.objects.bulk_create([
+            Wallet(currency=currency) for i in range(options['wallets'])
+        ])
+        wallets = list(Wallet.objects.filter(currency=currency).order_by('id'))
+        Address.objects.bulk_create([
+            Address(address=node.new_address(), currency=currency, wallet=w) for w in wallets
+        ])
+        addresses = list(Address.objects.filter(currency=currency).values_list('address', flat=True))
+
+        # Deposits: every block is scanned once, then confirmed
+        timings, queries = [], []
+        rpc_calls = node.calls
+        for i in range(options['blocks']):
+            node.synthesize_block(options['deposits'], addresses)
+            self.measure(timings, queries, tasks.query_transactions, currency.ticker)
+        node.generate(settings.CC_CONFIRMATIONS)
+        self.measure(timings, queries, tasks.query_transactions, currency.ticker)
+        deposits = options['blocks'] * options['deposits']
+        self.report('query_transactions', deposits, timings, queries, node.calls - rpc_calls)
+
+        # Withdrawals: create them, then send them in one go
+        wallets = list(Wallet.objects.filter(currency=currency, balance__gt=0).order_by('id'))
+        if not wallets:
+            return
+        amount = min(w.balance for w in wallets) / max(1, options['withdrawals'] // len(wallets) + 1)
+        timings, queries = [], []
+        for i in range(options['withdrawals']):
+            wallet = wallets[i % len(wallets)]
+            self.measure(timings, queries, wallet.withdraw_to_address, node.new_address(), amount)
+        self.report('withdraw_to_address', options['withdrawals'], timings, queries, 0)
+
+        timings, queries = [], []
+        rpc_calls = node.calls
+        self.measure(timings, queries, tasks.process_withdraw_transactions, currency.ticker)
+        self.report('process_withdraw_transactions', options['withdrawals'], timings, queries, node.calls - rpc_calls)
+
+    def report(self, name, operations, timings, queries, rpc_calls):
+        total = sum(timings)
+        self.stdout.write(self.style.SUCCESS(name))
+        self.stdout.write('  operations:      %d in %.3fs, %.1f/s' % (operations, total, operations / total if total else 0))
+        self.stdout.write('  queries/op:      %.2f' % (sum(queries) / float(operations or 1)))
+        self.stdout.write('  rpc calls/op:    %.2f' % (rpc_calls / float(operations or 1)))
+        self.stdout.write('  latency p50/p99: %.1fms / %.1fms' % (percentile(timings, 50) * 1000, percentile(timings, 99) * 1000))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cc.audit import verify_checkpoints
+from cc.tasks import create_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'Writes balance checkpoints for all wallets, or verifies the latest ones against the operations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticker', type=str, default=None)
+        parser.add_argument('--verify', action='store_true', help='only verify the latest checkpoints')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            create_checkpoints(options['ticker'])
+            self.stdout.write(self.style.SUCCESS('Checkpoints written'))
+            return
+
+        result = verify_checkpoints(options['ticker'])
+
+        if not result['mismatch']:
+            self.stdout.write(self.style.SUCCESS('Everything is allright'))
+
+        for m in result['mismatch']:
+            self.stdout.write(self.style.ERROR('Wallet: "%(wallet)s" %(field)s mismatch DB: %(db)s CHECKPOINT: %(checkpoint)s' % m))
@@ -0,0 +1,68 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, migrations, models
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import F, ExpressionWrapper
+from django.db.models.functions import Cast, Round
+
+from cc import settings
+from cc.checks import amount_column_mismatches
+
+
+def copy_amounts(model_name, name, target, decimal_places):
+    unit = Decimal(10) ** decimal_places
+
+    def copy(apps, schema_editor):
+        if settings.CC_INTEGER_AMOUNTS:
+            value = Cast(Round(ExpressionWrapper(F(name) * unit, output_field=models.DecimalField())),
+                         models.BigIntegerField())
+        else:
+            # Multiplied rather than divided, SQLite would divide integers
+            value = ExpressionWrapper(F(name) * (1 / unit), output_field=models.DecimalField())
+        apps.get_model('cc', model_name)._base_manager.update(**{target: value})
+
+    return migrations.RunPython(copy)
+
+
+class Command(BaseCommand):
+    help = 'Converts amount columns to BIGINT base units or back to NUMERIC, following CC_INTEGER_AMOUNTS'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', type=str, default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        mismatches = amount_column_mismatches(connection)
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Amount columns already match CC_INTEGER_AMOUNTS'))
+            return
+
+        # Every column is rebuilt like a migration would: a new column is
+        # filled from the old one, which is then dropped
+        loader = MigrationLoader(connection)
+        state = loader.project_state([key for key in loader.applied_migrations if key in loader.graph.nodes])
+        with connection.schema_editor() as schema_editor:
+            for model, field in mismatches:
+                model_name, name = model._meta.model_name, field.name
+                if settings.CC_INTEGER_AMOUNTS:
+                    temporary = models.BigIntegerField(null=True)
+                else:
+                    temporary = models.DecimalField(max_digits=field.max_digits, decimal_places=field.decimal_places, null=True)
+
+                for operation in [
+                    migrations.AddField(model_name=model_name, name=name + '_converted', field=temporary),
+                    copy_amounts(model_name, name, name + '_converted', field.decimal_places),
+                    migrations.RemoveField(model_name=model_name, name=name),
+                    migrations.RenameField(model_name=model_name, old_name=name + '_converted', new_name=name),
+                    migrations.AlterField(model_name=model_name, name=name, field=field.clone()),
+                ]:
+                    new_state = state.clone()
+                    operation.state_forwards('cc', new_state)
+                    operation.database_forwards('cc', schema_editor, state, new_state)
+                    state = new_state
+
+                self.stdout.write('%s.%s converted' % (model._meta.db_table, field.column))
+
+        self.stdout.write(self.style.SUCCESS('%s amount columns converted' % len(mismatches)))
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-17 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0011_magicbyte_charfield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='amount',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=18, null=True, verbose_name='Amount'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='block_hash',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='Block hash'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='block_height',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Block height'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['currency', 'processed', 'block_height'], name='cc_transact_currenc_2805e4_idx'),
+        ),
+    ]
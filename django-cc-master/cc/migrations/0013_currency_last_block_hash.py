@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0012_transaction_block_height'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currency',
+            name='last_block_hash',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='Last block hash'),
+        ),
+    ]
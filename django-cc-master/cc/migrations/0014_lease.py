@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-17 23:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0013_currency_last_block_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('deposite', 'Deposite'), ('withdraw', 'Withdraw')], max_length=10, verbose_name='Kind')),
+                ('token', models.PositiveIntegerField(default=0, verbose_name='Token')),
+                ('expires', models.DateTimeField(blank=True, null=True, verbose_name='Expires')),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cc.currency')),
+            ],
+            options={
+                'unique_together': {('currency', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0014_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation_id', models.PositiveIntegerField(verbose_name='Operation id')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created')),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Balance')),
+                ('holded', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Holded')),
+                ('unconfirmed', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Unconfirmed')),
+                ('total_received', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Total received')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='cc.wallet')),
+            ],
+            options={
+                'unique_together': {('wallet', 'operation_id')},
+            },
+        ),
+    ]
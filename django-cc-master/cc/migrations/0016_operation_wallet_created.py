@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0015_walletcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['wallet', 'created', 'id'], name='cc_operatio_wallet__f803a6_idx'),
+        ),
+    ]
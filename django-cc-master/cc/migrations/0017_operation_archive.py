@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('cc', '0016_operation_wallet_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperationArchive',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created')),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Balance')),
+                ('holded', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Holded')),
+                ('unconfirmed', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Unconfirmed')),
+                ('description', models.CharField(blank=True, max_length=100, null=True, verbose_name='Description')),
+                ('reason_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('reason_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_operations', to='cc.wallet')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OperationSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(verbose_name='Period')),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Balance')),
+                ('holded', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Holded')),
+                ('unconfirmed', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Unconfirmed')),
+                ('total_received', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Total received')),
+                ('operations', models.PositiveIntegerField(default=0, verbose_name='Operations')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operation_summaries', to='cc.wallet')),
+            ],
+            options={
+                'unique_together': {('wallet', 'period')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='operationarchive',
+            index=models.Index(fields=['wallet', 'created', 'id'], name='cc_operatio_wallet__37a2aa_idx'),
+        ),
+    ]
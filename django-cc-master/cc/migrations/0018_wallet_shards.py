@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0017_operation_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wallet',
+            name='shards',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Shards'),
+        ),
+        migrations.CreateModel(
+            name='WalletShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField(verbose_name='Index')),
+                ('balance', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Balance')),
+                ('holded', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Holded')),
+                ('unconfirmed', models.DecimalField(decimal_places=8, default=0, max_digits=18, verbose_name='Unconfirmed')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_shards', to='cc.wallet')),
+            ],
+            options={
+                'unique_together': {('wallet', 'index')},
+            },
+        ),
+    ]
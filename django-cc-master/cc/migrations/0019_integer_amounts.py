@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from django.db import migrations
+
+import cc.fields
+
+
+AMOUNT_FIELDS = [
+    ('currency', 'dust', {'default': Decimal('0.0000543'), 'verbose_name': 'Dust'}),
+    ('operation', 'balance', {'default': 0, 'verbose_name': 'Balance'}),
+    ('operation', 'holded', {'default': 0, 'verbose_name': 'Holded'}),
+    ('operation', 'unconfirmed', {'default': 0, 'verbose_name': 'Unconfirmed'}),
+    ('operationarchive', 'balance', {'default': 0, 'verbose_name': 'Balance'}),
+    ('operationarchive', 'holded', {'default': 0, 'verbose_name': 'Holded'}),
+    ('operationarchive', 'unconfirmed', {'default': 0, 'verbose_name': 'Unconfirmed'}),
+    ('operationsummary', 'balance', {'default': 0, 'verbose_name': 'Balance'}),
+    ('operationsummary', 'holded', {'default': 0, 'verbose_name': 'Holded'}),
+    ('operationsummary', 'total_received', {'default': 0, 'verbose_name': 'Total received'}),
+    ('operationsummary', 'unconfirmed', {'default': 0, 'verbose_name': 'Unconfirmed'}),
+    ('transaction', 'amount', {'blank': True, 'null': True, 'verbose_name': 'Amount'}),
+    ('wallet', 'balance', {'default': 0, 'verbose_name': 'Balance'}),
+    ('wallet', 'holded', {'default': 0, 'verbose_name': 'Holded'}),
+    ('wallet', 'unconfirmed', {'default': 0, 'verbose_name': 'Unconfirmed'}),
+    ('walletcheckpoint', 'balance', {'default': 0, 'verbose_name': 'Balance'}),
+    ('walletcheckpoint', 'holded', {'default': 0, 'verbose_name': 'Holded'}),
+    ('walletcheckpoint', 'total_received', {'default': 0, 'verbose_name': 'Total received'}),
+    ('walletcheckpoint', 'unconfirmed', {'default': 0, 'verbose_name': 'Unconfirmed'}),
+    ('walletshard', 'balance', {'default': 0, 'verbose_name': 'Balance'}),
+    ('walletshard', 'holded', {'default': 0, 'verbose_name': 'Holded'}),
+    ('walletshard', 'unconfirmed', {'default': 0, 'verbose_name': 'Unconfirmed'}),
+    ('withdrawtransaction', 'amount', {'verbose_name': 'Amount'}),
+    ('withdrawtransaction', 'fee', {'blank': True, 'null': True, 'verbose_name': 'Fee'}),
+]
+
+
+def operations():
+    """Amount columns become AmountField.
+
+    Only the model state changes, the columns are left as they are whatever
+    CC_INTEGER_AMOUNTS says. ``manage.py convert_amounts`` rebuilds them as
+    BIGINT base units or back as NUMERIC, see ``cc.checks``.
+    """
+    return [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name=model_name,
+                name=name,
+                field=cc.fields.AmountField(decimal_places=8, max_digits=18, **kwargs),
+            )
+            for model_name, name, kwargs in AMOUNT_FIELDS
+        ]),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0018_wallet_shards'),
+    ]
+
+    operations = operations()
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0019_integer_amounts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(condition=models.Q(('active', True), ('wallet', None)), fields=['currency', 'created'], name='cc_address_unassigned'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:10
+
+import cc.hd
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0020_address_unassigned_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currency',
+            name='xpub',
+            field=models.CharField(blank=True, max_length=120, null=True, validators=[cc.hd.validate_xpub], verbose_name='Extended public key'),
+        ),
+        migrations.AddField(
+            model_name='currency',
+            name='xpub_index',
+            field=models.PositiveIntegerField(default=0, verbose_name='Next derivation index'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0021_currency_xpub'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currency',
+            name='address_queue',
+            field=models.PositiveIntegerField(default=0, verbose_name='Address queue target'),
+        ),
+        migrations.AddField(
+            model_name='currency',
+            name='address_rate',
+            field=models.FloatField(default=0, verbose_name='Address claims per hour'),
+        ),
+        migrations.AddField(
+            model_name='currency',
+            name='address_rate_updated',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Address rate updated'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:18
+
+import cc.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0022_address_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currency',
+            name='withdraw_max_amount',
+            field=cc.fields.AmountField(blank=True, decimal_places=8, max_digits=18, null=True, verbose_name='Max amount per withdraw transaction'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0023_currency_withdraw_max_amount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wallet',
+            name='shards',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Shards'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0024_wallet_shards_not_editable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='imported',
+            field=models.BooleanField(default=True, verbose_name='Imported'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:48
+
+from django.db import migrations, models
+
+
+def count_assigned(apps, schema_editor):
+    # Otherwise the first refill takes every address ever assigned for new claims
+    Currency = apps.get_model('cc', 'Currency')
+    Address = apps.get_model('cc', 'Address')
+    for currency in Currency.objects.all():
+        Currency.objects.filter(ticker=currency.ticker).update(
+            address_assigned=Address.objects.filter(currency=currency).exclude(wallet=None).count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cc', '0025_address_imported'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currency',
+            name='address_assigned',
+            field=models.PositiveIntegerField(default=0, verbose_name='Assigned addresses'),
+        ),
+        migrations.RunPython(count_assigned, migrations.RunPython.noop),
+    ]
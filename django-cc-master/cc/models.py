@@ -1,137 +1,415 @@
 # -*- coding: utf-8 -*-
+from collections import defaultdict
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import timedelta
 from decimal import Decimal
+from zlib import crc32
+
+from bitcoinrpc.authproxy import JSONRPCException
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.core.validators import validate_comma_separated_integer_list
-from django.db import models
-from django.db.models import Sum
+from django.db import connection, models, transaction
+from django.db.models import F, Q, Count, Max, Sum
+from django.db.models.functions import TruncMonth
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 from cc import settings
-from cc.validator import validate
+from cc import notify
+from cc.fields import AmountField, as_amount
+from cc import hd
+from cc.validator import get_validator
+from cc import checks  # noqa, registers the system checks
+
+
+CHECKPOINT_FIELDS = ('balance', 'holded', 'unconfirmed', 'total_received')
+SHARD_FIELDS = ('balance', 'holded', 'unconfirmed')
+
+
+def encode_cursor(created, id):
+    return urlsafe_b64encode(('%s|%d' % (created.isoformat(), id)).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created, id = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        created = parse_datetime(created)
+        id = int(id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if created is None:
+        raise ValueError('Invalid cursor')
+    return created, id
+
 
 class Wallet(models.Model):
     currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
-    balance = models.DecimalField(_('Balance'), max_digits=18, decimal_places=8, default=0)
-    holded = models.DecimalField(_('Holded'), max_digits=18, decimal_places=8, default=0)
-    unconfirmed = models.DecimalField(_('Unconfirmed'), max_digits=18, decimal_places=8, default=0)
+    balance = AmountField(_('Balance'), default=0)
+    holded = AmountField(_('Holded'), default=0)
+    unconfirmed = AmountField(_('Unconfirmed'), default=0)
     label = models.CharField(_('Label'), max_length=100, blank=True, null=True, unique=True)
+    shards = models.PositiveSmallIntegerField(_('Shards'), default=0, editable=False)
 
     def __str__(self):
         return u'{0} {1} "{2}"'.format(self.balance, self.currency.ticker, self.label or '')
 
     def get_address(self):
-        active = Address.objects.filter(wallet=self, active=True, currency=self.currency)[:1]
+        active = Address.objects.filter(wallet=self, active=True, currency_id=self.currency_id)[:1]
         if active:
             return active[0]
 
-        unused = Address.objects.filter(wallet=None, active=True, currency=self.currency)[:1]
-        if unused:
-            free = unused[0]
-            free.wallet = self
-            free.save()
+        free = Address.claim(self)
+        if free:
+            if notify.address_claimed(self.currency_id):
+                from cc.tasks import refill_addresses_queue
+                refill_addresses_queue.delay(self.currency_id)
             return free
 
-        old = Address.objects.filter(wallet=self, active=False, currency=self.currency)[:1]
+        old = Address.objects.filter(wallet=self, active=False, currency_id=self.currency_id)[:1]
         if old:
             return old[0]
 
+    def _debit(self, amount, holded=0):
+        """Take ``amount`` off the balance in one conditional UPDATE.
+
+        Concurrent debits can't overdraw the wallet, the check happens in
+        the database against the current row rather than this instance.
+        """
+        updated = Wallet.objects.filter(
+            id=self.id,
+            balance__gte=amount - settings.CC_ALLOW_NEGATIVE_BALANCE,
+        ).update(
+            balance=F('balance') - as_amount(amount),
+            holded=F('holded') + as_amount(holded),
+        )
+        if not updated and self.shards:
+            # Shards only ever get credits, the main row may just lack them
+            self.fold_shards()
+            updated = Wallet.objects.filter(
+                id=self.id,
+                balance__gte=amount - settings.CC_ALLOW_NEGATIVE_BALANCE,
+            ).update(
+                balance=F('balance') - as_amount(amount),
+                holded=F('holded') + as_amount(holded),
+            )
+        if not updated:
+            raise ValueError('No money')
+
+        self.balance -= amount
+        self.holded += holded
+
+    def _credit(self, amount, key=''):
+        if self.shards:
+            updated = WalletShard.objects.filter(wallet=self, index=self.shard_index(key)) \
+                .update(balance=F('balance') + as_amount(amount))
+            if not updated:
+                raise ValueError('Wallet shard is missing, use set_shards')
+        else:
+            Wallet.objects.filter(id=self.id).update(balance=F('balance') + as_amount(amount))
+            self.balance += amount
+
+    def shard_index(self, key):
+        return crc32(str(key).encode('utf8')) % self.shards
+
+    def set_shards(self, count):
+        """Spread credits over ``count`` shard rows, 0 turns sharding off.
+
+        Busy wallets are credited without locking their own row, balances
+        are the sum of the row and its shards, see ``get_balance``.
+        """
+        with transaction.atomic():
+            self.fold_shards()
+            WalletShard.objects.filter(wallet=self, index__gte=count).delete()
+            existing = set(WalletShard.objects.filter(wallet=self).values_list('index', flat=True))
+            WalletShard.objects.bulk_create([
+                WalletShard(wallet=self, index=i) for i in range(count) if i not in existing
+            ])
+            Wallet.objects.filter(id=self.id).update(shards=count)
+            self.shards = count
+
+    def fold_shards(self):
+        """Move the shard totals into the wallet row"""
+        with transaction.atomic():
+            # The wallet row first, like _debit and create_checkpoint
+            list(Wallet.objects.select_for_update().filter(id=self.id).values_list('id'))
+            shards = list(WalletShard.objects.select_for_update().filter(wallet=self).order_by('index'))
+            totals = dict((k, sum(getattr(shard, k) for shard in shards)) for k in SHARD_FIELDS)
+            if not any(totals.values()):
+                return
+
+            Wallet.objects.filter(id=self.id).update(**dict((k, F(k) + as_amount(v)) for k, v in totals.items()))
+            WalletShard.objects.filter(id__in=[shard.id for shard in shards]).update(**dict((k, 0) for k in SHARD_FIELDS))
+            for k, v in totals.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    def get_balance(self):
+        """Current balance, holded and unconfirmed, shards included"""
+        totals = Wallet.objects.filter(id=self.id).values(*SHARD_FIELDS)[0]
+        if self.shards:
+            shards = WalletShard.objects.filter(wallet=self).aggregate(**dict((k, Sum(k)) for k in SHARD_FIELDS))
+            for k in SHARD_FIELDS:
+                totals[k] += shards[k] or Decimal('0')
+        return totals
+
     def withdraw(self, amount, description="", reason=None):
         if amount < 0:
             raise ValueError('Invalid amount')
 
-        if self.balance - amount < -settings.CC_ALLOW_NEGATIVE_BALANCE:
-            raise ValueError('No money')
-
-        Operation.objects.create(
-            wallet=self,
-            balance=-amount,
-            description=description,
-            reason=reason
-        )
-        self.balance -= amount
-        self.save()
+        with transaction.atomic():
+            self._debit(amount)
+            Operation.objects.create(
+                wallet=self,
+                balance=-amount,
+                description=description,
+                reason=reason
+            )
 
     def transfer(self, amount, deposite_wallet, reason=None, description=""):
         if amount < 0:
             raise ValueError('Invalid amount')
 
-        if self.balance - amount < -settings.CC_ALLOW_NEGATIVE_BALANCE:
-            raise ValueError('No money')
-
-        Operation.objects.create(
-            wallet=self,
-            balance=-amount,
-            description=description,
-            reason=reason
-        )
-        Operation.objects.create(
-            wallet=deposite_wallet,
-            balance=+amount,
-            description=description,
-            reason=reason
-        )
-        self.balance -= amount
-        self.save()
-        deposite_wallet.balance += amount
-        deposite_wallet.save()
+        with transaction.atomic():
+            # Rows are locked in id order, like post_batch, so opposite
+            # transfers between two wallets can't deadlock
+            ids = {self.id} if deposite_wallet.shards else {self.id, deposite_wallet.id}
+            list(Wallet.objects.select_for_update().filter(id__in=ids).order_by('id').values_list('id'))
+            self._debit(amount)
+            deposite_wallet._credit(amount, self.id)
+            Operation.objects.bulk_create([
+                Operation(
+                    wallet=self,
+                    balance=-amount,
+                    description=description,
+                    reason=reason
+                ),
+                Operation(
+                    wallet=deposite_wallet,
+                    balance=+amount,
+                    description=description,
+                    reason=reason
+                ),
+            ])
+
+    def transfer_many(self, legs):
+        """Transfer from this wallet, ``legs`` are ``(wallet, amount, reason, description)``"""
+        return Wallet.post_batch([(self,) + tuple(leg) for leg in legs])
+
+    @classmethod
+    def post_batch(cls, legs):
+        """Post many transfers in one database transaction.
+
+        ``legs`` are ``(from_wallet, to_wallet, amount, reason, description)``
+        tuples, reason and description may be left out. Wallets are locked in
+        id order and every wallet gets one update with its net change. If any
+        wallet can't cover its net debit nothing is posted and ValueError is
+        raised. Returns the created operations.
+        """
+        legs = [tuple(leg) + (None, "")[len(leg) - 3:] for leg in legs]
+        for leg in legs:
+            if leg[2] < 0:
+                raise ValueError('Invalid amount')
+
+        deltas = defaultdict(Decimal)
+        operations = []
+        for from_wallet, to_wallet, amount, reason, description in legs:
+            deltas[from_wallet.id] -= amount
+            deltas[to_wallet.id] += amount
+            operations.append(Operation(wallet=from_wallet, balance=-amount, description=description, reason=reason))
+            operations.append(Operation(wallet=to_wallet, balance=+amount, description=description, reason=reason))
+
+        with transaction.atomic():
+            locked = cls.objects.select_for_update().order_by('id').in_bulk(list(deltas))
+            for wallet_id in sorted(deltas):
+                wallet, delta = locked[wallet_id], deltas[wallet_id]
+                if delta < 0 and wallet.balance + delta < -settings.CC_ALLOW_NEGATIVE_BALANCE and wallet.shards:
+                    # Like _debit, the funds may still be in the shards
+                    wallet.fold_shards()
+                if delta < 0 and wallet.balance + delta < -settings.CC_ALLOW_NEGATIVE_BALANCE:
+                    raise ValueError('No money')
+
+            Operation.objects.bulk_create(operations)
+            for wallet_id in sorted(deltas):
+                if deltas[wallet_id]:
+                    cls.objects.filter(id=wallet_id).update(balance=F('balance') + as_amount(deltas[wallet_id]))
+
+        for leg in legs:
+            for wallet in leg[:2]:
+                wallet.balance = locked[wallet.id].balance + deltas[wallet.id]
+
+        return operations
 
     def withdraw_to_address(self, address, amount, description=""):
-        if not validate(address, self.currency.magicbyte):
+        if not get_validator(self.currency.magicbyte).validate(address):
             raise ValueError('Invalid address')
 
         if amount < 0:
             raise ValueError('Invalid amount')
 
-        if self.balance - amount < -settings.CC_ALLOW_NEGATIVE_BALANCE:
-            raise ValueError('No money')
-
-        tx = WithdrawTransaction.objects.create(
-            currency=self.currency,
-            amount=amount,
-            address=address,
-            wallet=self,
-        )
-        op = Operation.objects.create(
-            wallet=self,
-            balance=-amount,
-            holded=amount,
-            description=description,
-            reason=tx
-        )
-        self.balance -= amount
-        self.holded += amount
-        self.save()
+        with transaction.atomic():
+            self._debit(amount, holded=amount)
+            tx = WithdrawTransaction.objects.create(
+                currency=self.currency,
+                amount=amount,
+                address=address,
+                wallet=self,
+            )
+            op = Operation.objects.create(
+                wallet=self,
+                balance=-amount,
+                holded=amount,
+                description=description,
+                reason=tx
+            )
 
         return {
             'tx': tx,
             'op': op,
         }
 
+    def get_checkpoint(self):
+        return WalletCheckpoint.objects.filter(wallet=self).order_by('-operation_id').first()
+
+    def _operation_totals(self):
+        # Archived operations are always covered by a checkpoint, the
+        # summaries only matter if the checkpoints were removed
+        checkpoint = self.get_checkpoint()
+        operations = Operation.objects.filter(wallet=self)
+        if checkpoint:
+            operations = operations.filter(id__gt=checkpoint.operation_id)
+        else:
+            checkpoint = self.get_archive_summary()
+
+        # total_received goes first, the balance alias would shadow the field
+        totals = operations.aggregate(total_received=Sum('balance', filter=Q(balance__gt=0)),
+                                      balance=Sum('balance'),
+                                      holded=Sum('holded'),
+                                      unconfirmed=Sum('unconfirmed'),
+                                      operation_id=Max('id'))
+
+        for k in CHECKPOINT_FIELDS:
+            totals[k] = (totals[k] or Decimal('0')) + (getattr(checkpoint, k) if checkpoint else Decimal('0'))
+
+        return checkpoint, totals
+
     def total_received(self):
-        return Operation.objects.filter(wallet=self, balance__gt=0).aggregate(balance=Sum('balance'))['balance'] or Decimal('0')
+        return self._operation_totals()[1]['total_received']
 
     def recalc_balance(self, save=False):
-        recalc = Operation.objects.filter(wallet=self).aggregate(balance=Sum('balance'),
-                                   holded=Sum('holded'),
-                                   unconfirmed=Sum('unconfirmed'))
-
-        for k, v in recalc.items():
-            if v is None:
-                recalc[k] = Decimal('0')
+        recalc = self._operation_totals()[1]
+        recalc = dict((k, recalc[k]) for k in ('balance', 'holded', 'unconfirmed'))
 
         if save:
             self.balance = recalc['balance']
             self.holded = recalc['holded']
             self.unconfirmed = recalc['unconfirmed']
-            self.save()
+            with transaction.atomic():
+                WalletShard.objects.filter(wallet=self).update(**dict((k, 0) for k in SHARD_FIELDS))
+                self.save()
 
         return recalc
 
+    def create_checkpoint(self):
+        """Store the operation totals so far, returns the latest checkpoint.
+
+        The wallet row is locked meanwhile: every ledger write locks it
+        before inserting operations, so none can commit later with an id
+        the checkpoint has already passed.
+        """
+        with transaction.atomic():
+            list(Wallet.objects.select_for_update().filter(id=self.id).values_list('id'))
+            list(WalletShard.objects.select_for_update().filter(wallet=self).order_by('index').values_list('id'))
+            checkpoint, totals = self._operation_totals()
+            if totals['operation_id'] is None:
+                return self.get_checkpoint()
+
+            return WalletCheckpoint.objects.create(
+                wallet=self,
+                **dict((k, totals[k]) for k in ('operation_id',) + CHECKPOINT_FIELDS)
+            )
+
+    def get_archive_summary(self):
+        """Totals of all archived operations, None if nothing was archived"""
+        summary = OperationSummary.objects.filter(wallet=self).aggregate(
+            balance=Sum('balance'),
+            holded=Sum('holded'),
+            unconfirmed=Sum('unconfirmed'),
+            total_received=Sum('total_received'),
+            operations=Sum('operations'),
+        )
+        if summary['operations']:
+            return OperationSummary(wallet=self, **summary)
+
+    def archive_operations(self, before, batch_size=None):
+        """Move operations created before ``before`` to ``OperationArchive``.
+
+        A checkpoint is written first and only operations it covers are
+        moved, so balances never need the archive. Returns how many
+        operations were archived.
+        """
+        batch_size = batch_size or settings.CC_ARCHIVE_BATCH
+        checkpoint = self.create_checkpoint()
+        if not checkpoint:
+            return 0
+
+        operations = Operation.objects.filter(wallet=self, created__lt=before, id__lte=checkpoint.operation_id)
+        archived = 0
+        while True:
+            with transaction.atomic():
+                ids = list(operations.order_by('id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    return archived
+
+                batch = Operation.objects.filter(id__in=ids)
+                periods = batch.annotate(period=TruncMonth('created', output_field=models.DateField())) \
+                    .order_by().values('period') \
+                    .annotate(total_received=Sum('balance', filter=Q(balance__gt=0)),
+                              balance=Sum('balance'),
+                              holded=Sum('holded'),
+                              unconfirmed=Sum('unconfirmed'),
+                              operations=Count('id'))
+
+                for p in periods:
+                    summary, created = OperationSummary.objects.select_for_update() \
+                        .get_or_create(wallet=self, period=p['period'])
+                    for k in CHECKPOINT_FIELDS + ('operations',):
+                        setattr(summary, k, getattr(summary, k) + (p[k] or 0))
+                    summary.save()
+
+                OperationArchive.objects.bulk_create([
+                    OperationArchive(**dict((f.attname, getattr(op, f.attname)) for f in Operation._meta.concrete_fields))
+                    for op in batch
+                ])
+                batch.delete()
+                archived += len(ids)
+
     def get_operations(self):
-        return Operation.objects.filter(wallet=self).order_by('-created')
+        return Operation.objects.filter(wallet=self).order_by('-created', '-id')
+
+    def get_archived_operations(self):
+        return OperationArchive.objects.filter(wallet=self).order_by('-created', '-id')
+
+    def get_operations_page(self, after=None, limit=50):
+        """Return ``(operations, cursor)``, newest first.
+
+        Pass ``cursor`` as ``after`` to get the next page, it is None on the
+        last one. Pages are found through the (wallet, created, id) index,
+        so they cost the same at any depth of the history.
+        """
+        operations = self.get_operations().with_reasons()
+        if after:
+            created, id = decode_cursor(after)
+            operations = operations.filter(Q(created__lt=created) | Q(created=created, id__lt=id))
+
+        page = list(operations[:limit + 1])
+        if len(page) <= limit:
+            return page, None
+
+        page = page[:limit]
+        return page, encode_cursor(page[-1].created, page[-1].id)
 
     def get_unpaid_dust_summary(self):
         if not self.currency.dust:
@@ -149,37 +427,168 @@ class Wallet(models.Model):
         return dict(tx_hash)
 
 
+class OperationQuerySet(models.QuerySet):
+    def with_reasons(self):
+        """Fetch reasons with one query per reason model.
+
+        ContentTypes are looked up through Django's per process cache, a
+        page of operations costs three queries whatever its size.
+        """
+        return self.prefetch_related('reason')
+
+
 class Operation(models.Model):
+    objects = OperationQuerySet.as_manager()
+
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE)
     created = models.DateTimeField(_('Created'), default=now)
-    balance = models.DecimalField(_('Balance'), max_digits=18, decimal_places=8, default=0)
-    holded = models.DecimalField(_('Holded'), max_digits=18, decimal_places=8, default=0)
-    unconfirmed = models.DecimalField(_('Unconfirmed'), max_digits=18, decimal_places=8, default=0)
+    balance = AmountField(_('Balance'), default=0)
+    holded = AmountField(_('Holded'), default=0)
+    unconfirmed = AmountField(_('Unconfirmed'), default=0)
     description = models.CharField(_('Description'), max_length=100, blank=True, null=True)
     reason_content_type = models.ForeignKey(ContentType, null=True, blank=True, on_delete=models.CASCADE)
     reason_object_id = models.PositiveIntegerField(null=True, blank=True)
     reason = GenericForeignKey('reason_content_type', 'reason_object_id')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'created', 'id']),
+        ]
+
+
+class WalletShard(models.Model):
+    """Part of a sharded wallet's balance, see ``Wallet.set_shards``"""
+    wallet = models.ForeignKey(Wallet, related_name='balance_shards', on_delete=models.CASCADE)
+    index = models.PositiveSmallIntegerField(_('Index'))
+    balance = AmountField(_('Balance'), default=0)
+    holded = AmountField(_('Holded'), default=0)
+    unconfirmed = AmountField(_('Unconfirmed'), default=0)
+
+    class Meta:
+        unique_together = (('wallet', 'index'),)
+
+
+class OperationArchive(models.Model):
+    """Operation moved out of the hot table by ``Wallet.archive_operations``, it keeps its id"""
+    objects = OperationQuerySet.as_manager()
+
+    id = models.PositiveIntegerField(primary_key=True)
+    wallet = models.ForeignKey(Wallet, related_name='archived_operations', on_delete=models.CASCADE)
+    created = models.DateTimeField(_('Created'), default=now)
+    balance = AmountField(_('Balance'), default=0)
+    holded = AmountField(_('Holded'), default=0)
+    unconfirmed = AmountField(_('Unconfirmed'), default=0)
+    description = models.CharField(_('Description'), max_length=100, blank=True, null=True)
+    reason_content_type = models.ForeignKey(ContentType, null=True, blank=True, related_name='+', on_delete=models.CASCADE)
+    reason_object_id = models.PositiveIntegerField(null=True, blank=True)
+    reason = GenericForeignKey('reason_content_type', 'reason_object_id')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['wallet', 'created', 'id']),
+        ]
+
+
+class OperationSummary(models.Model):
+    """Totals of a wallet's archived operations created in a month"""
+    wallet = models.ForeignKey(Wallet, related_name='operation_summaries', on_delete=models.CASCADE)
+    period = models.DateField(_('Period'))
+    balance = AmountField(_('Balance'), default=0)
+    holded = AmountField(_('Holded'), default=0)
+    unconfirmed = AmountField(_('Unconfirmed'), default=0)
+    total_received = AmountField(_('Total received'), default=0)
+    operations = models.PositiveIntegerField(_('Operations'), default=0)
+
+    class Meta:
+        unique_together = (('wallet', 'period'),)
+
+
+class WalletCheckpoint(models.Model):
+    """Operation totals of a wallet up to and including ``operation_id``"""
+    wallet = models.ForeignKey(Wallet, related_name='checkpoints', on_delete=models.CASCADE)
+    operation_id = models.PositiveIntegerField(_('Operation id'))
+    created = models.DateTimeField(_('Created'), default=now)
+    balance = AmountField(_('Balance'), default=0)
+    holded = AmountField(_('Holded'), default=0)
+    unconfirmed = AmountField(_('Unconfirmed'), default=0)
+    total_received = AmountField(_('Total received'), default=0)
+
+    class Meta:
+        unique_together = (('wallet', 'operation_id'),)
+
 
 class Address(models.Model):
     address = models.CharField(_('Address'), max_length=50, primary_key=True)
     currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
     created = models.DateTimeField(_('Created'), default=now)
     active = models.BooleanField(_('Active'), default=True)
+    imported = models.BooleanField(_('Imported'), default=True)
     label = models.CharField(_('Label'), max_length=50, blank=True, null=True, default=None)
     wallet = models.ForeignKey(Wallet, blank=True, null=True, related_name="addresses", on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['currency', 'created'], name='cc_address_unassigned',
+                         condition=Q(wallet=None, active=True)),
+        ]
+
     def __str__(self):
         return u'{0}, {1}'.format(self.address, self.currency.ticker)
 
+    CLAIM_SQL = (
+        'UPDATE {table} SET wallet_id = %s WHERE address = ('
+        'SELECT address FROM {table} WHERE wallet_id IS NULL AND active AND currency_id = %s '
+        'ORDER BY created LIMIT 1 FOR UPDATE SKIP LOCKED'
+        ') AND wallet_id IS NULL RETURNING *'
+    )
+
+    @classmethod
+    def claim(cls, wallet, attempts=5):
+        """Attach a free address to ``wallet`` and return it, None if there is none.
+
+        On PostgreSQL this is one statement, concurrent claims skip the
+        rows locked by each other instead of waiting for them. Elsewhere
+        a conditional UPDATE makes sure an address is only claimed once.
+        """
+        free = cls.objects.filter(wallet=None, active=True, currency_id=wallet.currency_id).order_by('created')
+
+        if connection.vendor == 'postgresql':
+            claimed = list(cls.objects.raw(cls.CLAIM_SQL.format(table=cls._meta.db_table),
+                                           [wallet.id, wallet.currency_id]))
+            return claimed[0] if claimed else None
+
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                address = free.select_for_update(skip_locked=True).first()
+                if address:
+                    cls.objects.filter(address=address.address).update(wallet=wallet)
+                    address.wallet = wallet
+                return address
+
+        for i in range(attempts):
+            address = free.first()
+            if address is None:
+                return None
+            if cls.objects.filter(address=address.address, wallet=None).update(wallet=wallet):
+                address.wallet = wallet
+                return address
+
 
 class Currency(models.Model):
     ticker = models.CharField(_('Ticker'), max_length=4, default='BTC', primary_key=True)
     label = models.CharField(_('Label'), max_length=20, default='Bitcoin', unique=True)
     magicbyte = models.CharField(_('Magicbytes'), max_length=10, default='0,5', validators=[validate_comma_separated_integer_list])
     last_block = models.PositiveIntegerField(_('Last block'), blank=True, null=True, default=0)
+    last_block_hash = models.CharField(_('Last block hash'), max_length=100, blank=True, null=True)
     api_url = models.CharField(_('API hostname'), default='http://localhost:8332', max_length=100, blank=True, null=True)
-    dust = models.DecimalField(_('Dust'), max_digits=18, decimal_places=8, default=Decimal('0.0000543'))
+    dust = AmountField(_('Dust'), default=Decimal('0.0000543'))
+    withdraw_max_amount = AmountField(_('Max amount per withdraw transaction'), blank=True, null=True)
+    xpub = models.CharField(_('Extended public key'), max_length=120, blank=True, null=True, validators=[hd.validate_xpub])
+    xpub_index = models.PositiveIntegerField(_('Next derivation index'), default=0)
+    address_rate = models.FloatField(_('Address claims per hour'), default=0)
+    address_queue = models.PositiveIntegerField(_('Address queue target'), default=0)
+    address_assigned = models.PositiveIntegerField(_('Assigned addresses'), default=0)
+    address_rate_updated = models.DateTimeField(_('Address rate updated'), blank=True, null=True)
 
     class Meta:
         verbose_name_plural = _('currencies')
@@ -187,15 +596,31 @@ class Currency(models.Model):
     def __str__(self):
         return self.label
 
+    def clean(self):
+        if not self.xpub:
+            return
+
+        from cc.rpc import get_client
+        try:
+            hd.check_node(get_client(self.api_url), self.xpub, self.magicbyte)
+        except (ValueError, IOError, JSONRPCException) as e:
+            raise ValidationError({'xpub': str(e)})
+
 
 class Transaction(models.Model):
     txid = models.CharField(_('Txid'), max_length=100)
     address = models.CharField(_('Address'), max_length=50)
     currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
     processed = models.BooleanField(_('Processed'), default=False)
+    amount = AmountField(_('Amount'), blank=True, null=True)
+    block_height = models.PositiveIntegerField(_('Block height'), blank=True, null=True)
+    block_hash = models.CharField(_('Block hash'), max_length=100, blank=True, null=True)
 
     class Meta:
         unique_together = (('txid', 'address'),)
+        indexes = [
+            models.Index(fields=['currency', 'processed', 'block_height']),
+        ]
 
 
 class WithdrawTransaction(models.Model):
@@ -208,11 +633,66 @@ class WithdrawTransaction(models.Model):
         ('DONE', 'Done'),
     )
     currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
-    amount = models.DecimalField(_('Amount'), max_digits=18, decimal_places=8)
+    amount = AmountField(_('Amount'))
     address = models.CharField(_('Address'), max_length=50)
     wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE)
     created = models.DateTimeField(_('Created'), default=now)
     txid = models.CharField(_('Txid'), max_length=100, blank=True, null=True, db_index=True)
     walletconflicts = models.CharField(_('Walletconflicts txid'), max_length=100, blank=True, null=True, db_index=True)
     state = models.CharField(_('State'), max_length=10, choices=WTX_STATES, default=NEW)
-    fee = models.DecimalField(_('Fee'), max_digits=18, decimal_places=8, null=True, blank=True)
+    fee = AmountField(_('Fee'), null=True, blank=True)
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Lease(models.Model):
+    """Per currency lock for a kind of task, held outside DB transactions.
+
+    Every ``acquire`` bumps ``token``. Ledger writes call ``fence`` with the
+    token they were started with, so a worker whose lease expired and was
+    taken over can't commit stale results.
+    """
+    DEPOSITE = 'deposite'
+    WITHDRAW = 'withdraw'
+    KINDS = (
+        (DEPOSITE, 'Deposite'),
+        (WITHDRAW, 'Withdraw'),
+    )
+    currency = models.ForeignKey('Currency', on_delete=models.CASCADE)
+    kind = models.CharField(_('Kind'), max_length=10, choices=KINDS)
+    token = models.PositiveIntegerField(_('Token'), default=0)
+    expires = models.DateTimeField(_('Expires'), blank=True, null=True)
+
+    class Meta:
+        unique_together = (('currency', 'kind'),)
+
+    @classmethod
+    def acquire(cls, currency, kind, timeout=None):
+        with transaction.atomic():
+            lease, created = cls.objects.select_for_update().get_or_create(currency=currency, kind=kind)
+            if lease.expires and lease.expires > now():
+                return None
+
+            lease.token += 1
+            lease.expires = now() + timedelta(seconds=timeout or settings.CC_LEASE_TIMEOUT)
+            lease.save()
+            return lease.token
+
+    @classmethod
+    def release(cls, currency, kind, token):
+        cls.objects.filter(currency=currency, kind=kind, token=token).update(expires=None)
+
+    @classmethod
+    def fence(cls, currency, kind, token):
+        """Lock the lease row until the end of the current transaction.
+
+        The lease is renewed for ``CC_LEASE_TIMEOUT``, so a long task that
+        keeps committing doesn't lose it half way.
+        """
+        lease = cls.objects.select_for_update().get(currency=currency, kind=kind)
+        if lease.token != token or not lease.expires or lease.expires <= now():
+            raise LeaseLost('{0} {1} lease {2} is lost'.format(currency, kind, token))
+
+        cls.objects.filter(id=lease.id).update(expires=now() + timedelta(seconds=settings.CC_LEASE_TIMEOUT))
@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+from django.core.cache import caches
+
+from . import settings
+
+
+SCAN_KEY = 'cc:scan:{0}'
+WALLETNOTIFY_KEY = 'cc:walletnotify:{0}:{1}'
+COLLAPSED_KEY = 'cc:collapsed:{0}:{1}'
+CLAIMS_KEY = 'cc:claims:{0}'
+REFILL_AT_KEY = 'cc:refill-at:{0}'
+REFILL_KEY = 'cc:refill:{0}'
+
+
+def get_cache():
+    return caches[settings.CC_NOTIFY_CACHE]
+
+
+def _incr(key):
+    cache = get_cache()
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        cache.set(key, 1, None)
+        return 1
+
+
+def _collapsed(kind, ticker):
+    _incr(COLLAPSED_KEY.format(kind, ticker))
+
+
+def schedule_scan(ticker):
+    """True if no ``query_transactions`` run is pending for ``ticker`` yet"""
+    if get_cache().add(SCAN_KEY.format(ticker), 1, settings.CC_BLOCKNOTIFY_WINDOW):
+        return True
+    _collapsed('blocknotify', ticker)
+    return False
+
+
+def scan_started(ticker):
+    get_cache().delete(SCAN_KEY.format(ticker))
+
+
+def schedule_txid(ticker, txid):
+    """True unless ``txid`` was already scheduled within the window"""
+    if get_cache().add(WALLETNOTIFY_KEY.format(ticker, txid), 1, settings.CC_WALLETNOTIFY_WINDOW):
+        return True
+    _collapsed('walletnotify', ticker)
+    return False
+
+
+def collapsed_counts(ticker):
+    cache = get_cache()
+    return {
+        'blocknotify': cache.get(COLLAPSED_KEY.format('blocknotify', ticker), 0),
+        'walletnotify': cache.get(COLLAPSED_KEY.format('walletnotify', ticker), 0),
+    }
+
+
+def address_claimed(ticker):
+    """Count a pool address claim, True if the pool should be refilled now.
+
+    Only early refills rely on this count, with a per-process cache each
+    process counts its own claims.
+    """
+    claims = _incr(CLAIMS_KEY.format(ticker))
+    refill_at = get_cache().get(REFILL_AT_KEY.format(ticker))
+    # Held until the refill runs, the scheduled one clears it at the latest
+    return bool(refill_at) and claims >= refill_at and \
+        get_cache().add(REFILL_KEY.format(ticker), 1, settings.CC_ADDRESS_REFILL_INTERVAL)
+
+
+def schedule_refill(ticker, claims):
+    """Ask for an early refill once ``claims`` more addresses are claimed"""
+    cache = get_cache()
+    cache.set(CLAIMS_KEY.format(ticker), 0, None)
+    cache.set(REFILL_AT_KEY.format(ticker), claims, None)
+    cache.delete(REFILL_KEY.format(ticker))
@@ -0,0 +1,324 @@
+from __future__ import absolute_import
+import os
+import re
+import json
+import base64
+import codecs
+import decimal
+import threading
+from time import monotonic
+from queue import LifoQueue, Empty, Full
+from urllib.parse import urlparse
+from http.client import CannotSendRequest, HTTPConnection, HTTPSConnection
+
+from bitcoinrpc.authproxy import AuthServiceProxy, JSONRPCException, EncodeDecimal
+
+from . import settings
+
+
+RECONNECT_ERRORS = (CannotSendRequest, BrokenPipeError)
+# Codes python-bitcoinrpc uses for broken responses rather than failed calls
+TRANSPORT_ERRORS = (-342, -343)
+STREAM_BUFFER = 64 * 1024
+
+
+class JSONArrayStream(object):
+    """Incremental parser yielding the items of one array of a JSON document.
+
+    Text is fed in arbitrary pieces. Items of the array under ``key`` are
+    returned by ``feed`` as soon as they are complete, the rest of the
+    document (with an emptied array) is returned by ``close``.
+    """
+    STRUCTURE = re.compile(r'[\[\]{}",]')
+    STRING = re.compile(r'["\\]')
+
+    def __init__(self, key):
+        self.key = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self.head = ''
+        self.tail = []
+        self.item = []
+        self.items = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, text):
+        if self.done:
+            self.tail.append(text)
+            return []
+
+        if not self.items:
+            self.head += text
+            m = self.key.search(self.head)
+            if not m:
+                return []
+            text = self.head[m.end():]
+            self.head = self.head[:m.end()]
+            self.items = True
+
+        return self._scan(text)
+
+    def _scan(self, text):
+        items = []
+        start = pos = 0
+        while pos < len(text):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    pos += 1
+                    continue
+                m = self.STRING.search(text, pos)
+                if not m:
+                    break
+                pos = m.end()
+                if m.group() == '\\':
+                    self.escape = True
+                else:
+                    self.in_string = False
+                continue
+
+            m = self.STRUCTURE.search(text, pos)
+            if not m:
+                break
+            char, pos = m.group(), m.end()
+
+            if char == '"':
+                self.in_string = True
+            elif char in '[{':
+                self.depth += 1
+            elif char == ',':
+                if self.depth == 0:
+                    self._item(items, text[start:m.start()])
+                    start = pos
+            elif self.depth == 0:
+                # The array is closed
+                self._item(items, text[start:m.start()])
+                self.done = True
+                self.tail.append(text[m.start():])
+                return items
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self._item(items, text[start:pos])
+                    start = pos
+
+        self.item.append(text[start:])
+        return items
+
+    def _item(self, items, text):
+        self.item.append(text)
+        data = ''.join(self.item).lstrip(', \t\r\n')
+        self.item = []
+        if data.strip():
+            items.append(json.loads(data, parse_float=decimal.Decimal))
+
+    def close(self):
+        if self.items and not self.done:
+            raise ValueError('Truncated JSON document')
+        return json.loads(self.head + ''.join(self.tail), parse_float=decimal.Decimal)
+
+
+class RPCStream(object):
+    """Result of ``CoinClient.stream``.
+
+    Iterating yields the items of the streamed array one by one; once it is
+    exhausted ``result`` holds the rest of the call result.
+    """
+
+    def __init__(self, client, method, args, key):
+        self.client = client
+        self.key = key
+        self.result = None
+        self._conn = client._acquire()
+        try:
+            self._response = self._request(method, args)
+        except Exception:
+            self._conn.close()
+            raise
+
+    def _request(self, method, args):
+        url = self.client._url
+        auth = base64.b64encode(('%s:%s' % (url.username, url.password)).encode('utf8'))
+        postdata = json.dumps({
+            'version': '1.1',
+            'method': method,
+            'params': args,
+            'id': 1,
+        }, default=EncodeDecimal)
+        headers = {
+            'Host': url.hostname,
+            'User-Agent': 'django-cc',
+            'Authorization': b'Basic ' + auth,
+            'Content-type': 'application/json',
+        }
+        try:
+            self._conn.request('POST', url.path, postdata, headers)
+        except RECONNECT_ERRORS:
+            self._conn.close()
+            self._conn.request('POST', url.path, postdata, headers)
+
+        response = self._conn.getresponse()
+        if response.getheader('Content-Type') != 'application/json':
+            raise JSONRPCException({
+                'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (response.status, response.reason)})
+        return response
+
+    def __iter__(self):
+        parser = JSONArrayStream(self.key)
+        decoder = codecs.getincrementaldecoder('utf8')()
+        try:
+            while True:
+                chunk = self._response.read(STREAM_BUFFER)
+                for item in parser.feed(decoder.decode(chunk, final=not chunk)):
+                    yield item
+                if not chunk:
+                    break
+            response = parser.close()
+        except BaseException:
+            # Includes GeneratorExit, the rest of the response is unread
+            self._conn.close()
+            raise
+
+        self.client._release(self._conn)
+        if response.get('error') is not None:
+            raise JSONRPCException(response['error'])
+        self.result = response['result']
+
+
+class CoinClient(object):
+    """JSON-RPC client holding a small pool of keep-alive HTTP connections.
+
+    Attribute access mirrors ``AuthServiceProxy``: ``client.getblockcount()``.
+    """
+
+    def __init__(self, url, pool_size=None, timeout=None, keepalive=None):
+        self.url = url
+        self.timeout = timeout or settings.CC_RPC_TIMEOUT
+        self.keepalive = keepalive or settings.CC_RPC_KEEPALIVE
+        self._url = urlparse(url)
+        self._pool = LifoQueue(maxsize=pool_size or settings.CC_RPC_POOL_SIZE)
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+
+        def method(*args):
+            return self.call(name, *args)
+
+        method.__name__ = name
+        return method
+
+    def _connect(self):
+        if self._url.scheme == 'https':
+            return HTTPSConnection(self._url.hostname, self._url.port or 443, timeout=self.timeout)
+        return HTTPConnection(self._url.hostname, self._url.port or 80, timeout=self.timeout)
+
+    def _acquire(self):
+        while True:
+            try:
+                conn, released = self._pool.get_nowait()
+            except Empty:
+                return self._connect()
+
+            # Don't race the node closing an idle keep-alive connection
+            if monotonic() - released < self.keepalive:
+                return conn
+            conn.close()
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait((conn, monotonic()))
+        except Full:
+            conn.close()
+
+    def _request(self, func):
+        conn = self._acquire()
+        try:
+            try:
+                result = func(AuthServiceProxy(self.url, timeout=self.timeout, connection=conn))
+            except RECONNECT_ERRORS:
+                conn.close()
+                result = func(AuthServiceProxy(self.url, timeout=self.timeout, connection=conn))
+        except JSONRPCException as e:
+            if (e.error or {}).get('code') in TRANSPORT_ERRORS:
+                # The response was missing or garbled, the connection isn't usable
+                conn.close()
+            else:
+                # The node answered with an error, the connection is reusable
+                self._release(conn)
+            raise
+        except Exception:
+            conn.close()
+            raise
+
+        self._release(conn)
+        return result
+
+    def call(self, method, *args):
+        return self._request(lambda proxy: getattr(proxy, method)(*args))
+
+    def batch(self, calls, chunk_size=None, errors=False):
+        """Run ``[[method, params...], ...]`` as JSON-RPC batch requests.
+
+        Calls are sent in chunks of ``CC_RPC_BATCH_SIZE``, results are
+        returned in the order of ``calls``. A failed call raises its
+        ``JSONRPCException``; with ``errors`` the exception is returned in
+        place of its result instead. ``batch_`` only reports the first error
+        of a response, so a chunk with errors is split and sent again until
+        they are isolated: use ``errors`` for read-only calls only.
+        """
+        chunk_size = chunk_size or settings.CC_RPC_BATCH_SIZE
+        results = []
+        for i in range(0, len(calls), chunk_size):
+            results.extend(self._batch(calls[i:i + chunk_size], errors))
+        return results
+
+    def _batch(self, calls, errors):
+        try:
+            # batch_ consumes the call lists, copy them for every attempt
+            return self._request(lambda proxy: proxy.batch_([list(c) for c in calls]))
+        except JSONRPCException as e:
+            if not errors or (e.error or {}).get('code') in TRANSPORT_ERRORS:
+                raise
+            if len(calls) == 1:
+                return [e]
+            half = len(calls) // 2
+            return self._batch(calls[:half], errors) + self._batch(calls[half:], errors)
+
+    def stream(self, method, *args, **kwargs):
+        """Call ``method`` and stream the array ``key`` of its result.
+
+        The request is sent right away; items are parsed while the response
+        is being read, so a huge result never sits in memory as a whole.
+        """
+        return RPCStream(self, method, args, kwargs.get('key', 'transactions'))
+
+    def close(self):
+        while True:
+            try:
+                conn, released = self._pool.get_nowait()
+            except Empty:
+                return
+            conn.close()
+
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def get_client(url):
+    """Return the per-process ``CoinClient`` for a ``Currency.api_url``"""
+    global _clients_pid
+
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            # Connections must not be shared with a forked parent
+            _clients.clear()
+            _clients_pid = os.getpid()
+
+        if url not in _clients:
+            _clients[url] = CoinClient(url)
+
+        return _clients[url]
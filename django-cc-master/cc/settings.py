@@ -6,3 +6,26 @@ CC_ADDRESS_QUEUE = getattr(settings, 'CC_ADDRESS_QUEUE', 20)
 CC_ALLOW_NEGATIVE_BALANCE = getattr(settings, 'CC_ALLOW_NEGATIVE_BALANCE', Decimal('0.001'))
 CC_ACCOUNT = getattr(settings, 'CC_ACCOUNT', '')
 CC_ALLOWED_HOSTS = getattr(settings, 'CC_ALLOWED_HOSTS', ['localhost', '127.0.0.1'])
+CC_RPC_POOL_SIZE = getattr(settings, 'CC_RPC_POOL_SIZE', 4)
+CC_RPC_TIMEOUT = getattr(settings, 'CC_RPC_TIMEOUT', 30)
+CC_RPC_KEEPALIVE = getattr(settings, 'CC_RPC_KEEPALIVE', 15)
+CC_RPC_BATCH_SIZE = getattr(settings, 'CC_RPC_BATCH_SIZE', 100)
+CC_REORG_WINDOW = getattr(settings, 'CC_REORG_WINDOW', 10)
+CC_LEASE_TIMEOUT = getattr(settings, 'CC_LEASE_TIMEOUT', 600)
+CC_NOTIFY_CACHE = getattr(settings, 'CC_NOTIFY_CACHE', 'default')
+CC_BLOCKNOTIFY_WINDOW = getattr(settings, 'CC_BLOCKNOTIFY_WINDOW', 10)
+CC_WALLETNOTIFY_WINDOW = getattr(settings, 'CC_WALLETNOTIFY_WINDOW', 5)
+CC_RPC_STREAMING = getattr(settings, 'CC_RPC_STREAMING', False)
+CC_RPC_STREAM_CHUNK = getattr(settings, 'CC_RPC_STREAM_CHUNK', 1000)
+CC_ARCHIVE_AFTER = getattr(settings, 'CC_ARCHIVE_AFTER', 90)
+CC_ARCHIVE_BATCH = getattr(settings, 'CC_ARCHIVE_BATCH', 1000)
+CC_INTEGER_AMOUNTS = getattr(settings, 'CC_INTEGER_AMOUNTS', False)
+CC_VALIDATOR_CACHE = getattr(settings, 'CC_VALIDATOR_CACHE', 100000)
+CC_VALIDATOR_POOL_THRESHOLD = getattr(settings, 'CC_VALIDATOR_POOL_THRESHOLD', 50000)
+CC_VALIDATOR_PROCESSES = getattr(settings, 'CC_VALIDATOR_PROCESSES', None)
+CC_ADDRESS_QUEUE_MAX = getattr(settings, 'CC_ADDRESS_QUEUE_MAX', 10000)
+CC_ADDRESS_QUEUE_HEADROOM = getattr(settings, 'CC_ADDRESS_QUEUE_HEADROOM', 2)
+CC_ADDRESS_REFILL_INTERVAL = getattr(settings, 'CC_ADDRESS_REFILL_INTERVAL', 3600)
+CC_ADDRESS_RATE_ALPHA = getattr(settings, 'CC_ADDRESS_RATE_ALPHA', 0.3)
+CC_WITHDRAW_MAX_OUTPUTS = getattr(settings, 'CC_WITHDRAW_MAX_OUTPUTS', 500)
+CC_WITHDRAW_CONCURRENCY = getattr(settings, 'CC_WITHDRAW_CONCURRENCY', 1)
@@ -1,4 +1,5 @@
 import django.dispatch
 
 
-post_deposite = django.dispatch.Signal(providing_args=["instance"])
+# ``balance`` is the wallet's balance, holded and unconfirmed, shards included
+post_deposite = django.dispatch.Signal(providing_args=["instance", "balance"])
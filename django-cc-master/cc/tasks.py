@@ -1,124 +1,368 @@
 from __future__ import absolute_import
+import math
 from socket import error as socket_error
 from decimal import Decimal
+from datetime import timedelta
 from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from http.client import CannotSendRequest
 
 from celery import shared_task
 from celery.utils.log import get_task_logger
-from bitcoinrpc.authproxy import AuthServiceProxy
+from bitcoinrpc.authproxy import JSONRPCException
 
+from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
+from django.db.models import F, Q, Count, Max, Sum
+from django.utils.timezone import now
 
-from .models import (Wallet, Currency, Transaction, Address,
-                       WithdrawTransaction, Operation)
+from .models import (Wallet, WalletShard, Currency, Transaction, Address,
+                       WithdrawTransaction, Operation, Lease, LeaseLost, SHARD_FIELDS)
 from . import settings
+from .fields import as_amount
+from . import notify
+from . import hd
+from . import checks
+from .rpc import get_client, RPCStream
 from .signals import post_deposite
 
 logger = get_task_logger(__name__)
 
 
-@shared_task(throws=(socket_error,))
-@transaction.atomic
+@contextmanager
+def lease(currency, kind):
+    token = Lease.acquire(currency, kind)
+    if token is None:
+        logger.info('%s %s lease is held by another worker', currency.ticker, kind)
+    try:
+        yield token
+    finally:
+        if token is not None:
+            Lease.release(currency, kind, token)
+
+
+@shared_task(throws=(socket_error, LeaseLost))
 def query_transactions(ticker=None):
+    checks.require_amount_columns()
     if not ticker:
         for c in Currency.objects.all():
             query_transactions.delay(c.ticker)
         return
 
-    currency = Currency.objects.select_for_update().get(ticker=ticker)
-    coin = AuthServiceProxy(currency.api_url)
-    current_block = coin.getblockcount()
+    notify.scan_started(ticker)
+    currency = Currency.objects.get(ticker=ticker)
+    with lease(currency, Lease.DEPOSITE) as token:
+        if token is None:
+            # Blocks may arrive during the running scan, check again later
+            if notify.schedule_scan(ticker):
+                query_transactions.apply_async(kwargs={'ticker': ticker}, countdown=settings.CC_BLOCKNOTIFY_WINDOW)
+            return
+
+        scan_transactions(currency, token)
+
+
+def scan_transactions(currency, token):
+    ticker = currency.ticker
+    coin = get_client(currency.api_url)
+    current_block, since = listsinceblock(coin, currency)
 
-    block_hash = coin.getblockhash(currency.last_block)
-    transactions = coin.listsinceblock(block_hash)['transactions']
+    if isinstance(since, RPCStream):
+        # A crash half way is fine, ingestion skips entries seen before
+        for chunk in chunks(since, settings.CC_RPC_STREAM_CHUNK):
+            with transaction.atomic():
+                Lease.fence(currency, Lease.DEPOSITE, token)
+                process_deposite_transactions(chunk, ticker, current_block)
+        since = since.result
+        current_block = block_height(coin, since['lastblock'])
 
-    for tx in transactions:
-        if tx['category'] not in ('receive', 'generate', 'immature'):
+    with transaction.atomic():
+        Lease.fence(currency, Lease.DEPOSITE, token)
+        process_deposite_transactions(since['transactions'], ticker, current_block)
+        Currency.objects.filter(ticker=ticker).update(
+            last_block=current_block,
+            last_block_hash=since['lastblock'],
+        )
+
+    # Deposits with a known block height are confirmed without asking the node
+    confirmed_height = current_block - settings.CC_CONFIRMATIONS + 1
+    txdicts = [{
+        'category': 'receive',
+        'txid': tx['txid'],
+        'address': tx['address'],
+        'amount': tx['amount'],
+        'confirmations': current_block - tx['block_height'] + 1,
+        'blockhash': tx['block_hash'],
+    } for tx in Transaction.objects.filter(
+        processed=False,
+        currency=currency,
+        amount__isnull=False,
+        block_height__lte=confirmed_height,
+    ).values('txid', 'address', 'amount', 'block_height', 'block_hash')]
+    with transaction.atomic():
+        Lease.fence(currency, Lease.DEPOSITE, token)
+        process_deposite_transactions(txdicts, ticker, current_block)
+
+    # Mempool, immature and reorg-suspect deposits still need gettransaction
+    pending = list(Transaction.objects.filter(processed=False, currency=currency)
+                   .filter(Q(block_height=None) | Q(amount=None) | Q(block_height__gt=current_block))
+                   .values_list('txid', flat=True).distinct())
+    txdicts = []
+    for txid, data in zip(pending, coin.batch([['gettransaction', txid] for txid in pending], errors=True)):
+        if isinstance(data, JSONRPCException):
+            # e.g. conflicted or evicted, the rest still gets confirmed
+            logger.warning('%s: gettransaction %s failed: %s', ticker, txid, data.error)
             continue
+        txdicts.extend(normalise_txifno(data))
+    with transaction.atomic():
+        Lease.fence(currency, Lease.DEPOSITE, token)
+        process_deposite_transactions(txdicts, ticker, current_block)
+
+
+def listsinceblock(coin, currency):
+    """Fetch wallet transactions after the ``currency`` block cursor.
+
+    A routine run is a single batch request and a ``getblockheader`` call
+    for the height of the returned ``lastblock``. If the cursor block has
+    left the main chain the scan is rewound by ``CC_REORG_WINDOW`` blocks
+    and unconfirmed deposits above that height go back to
+    ``gettransaction``. Returns ``(current_block, listsinceblock_result)``,
+    the result is an ``RPCStream`` if ``CC_RPC_STREAMING`` is on and the
+    height then only an upper bound until it has been read.
+    """
+    last_block = currency.last_block or 0
+    if currency.last_block_hash:
+        calls = [['getblockhash', last_block]]
+        if not settings.CC_RPC_STREAMING:
+            calls += [['listsinceblock', currency.last_block_hash]]
+        try:
+            results = coin.batch(calls)
+        except JSONRPCException:
+            # The chain got shorter than the cursor
+            results = [None]
+
+        if results[0] == currency.last_block_hash:
+            if settings.CC_RPC_STREAMING:
+                return stream_since(coin, currency.last_block_hash)
+            return block_height(coin, results[1]['lastblock']), results[1]
+
+        logger.warning('%s: block %s %s left the main chain, rewinding %s blocks',
+                       currency.ticker, last_block, currency.last_block_hash, settings.CC_REORG_WINDOW)
+        last_block = max(0, last_block - settings.CC_REORG_WINDOW)
+        Transaction.objects.filter(currency=currency, processed=False, block_height__gt=last_block) \
+            .update(block_height=None, block_hash=None)
+
+    block_hash = coin.getblockhash(last_block)
+    if settings.CC_RPC_STREAMING:
+        return stream_since(coin, block_hash)
+
+    since = coin.listsinceblock(block_hash)
+    return block_height(coin, since['lastblock']), since
+
+
+def block_height(coin, block_hash):
+    """Height of ``block_hash``, stored with it so the cursor is consistent"""
+    return coin.getblockheader(block_hash)['height']
+
+
+def stream_since(coin, block_hash):
+    since = coin.stream('listsinceblock', block_hash)
+    # The node has rendered the whole response by now, so confirmations in it
+    # were counted at this height or below
+    return coin.getblockcount(), since
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+DEPOSITE_CATEGORIES = ('receive', 'generate', 'immature')
+
 
-        process_deposite_transaction(tx, ticker)
+def process_deposite_transaction(txdict, ticker):
+    process_deposite_transactions([txdict], ticker)
 
-    currency.last_block = current_block
-    currency.save()
 
-    for tx in Transaction.objects.filter(processed=False, currency=currency):
-        query_transaction(ticker, tx.txid)
+def get_block_height(txdict, current_block=None):
+    """Height of the block ``txdict`` was mined in, if it can be told"""
+    if txdict['category'] == 'immature' or txdict['confirmations'] <= 0:
+        return None
+    if 'blockheight' in txdict:
+        return txdict['blockheight']
+    if current_block is not None:
+        return current_block - txdict['confirmations'] + 1
 
 
 @transaction.atomic
-def process_deposite_transaction(txdict, ticker):
-    if txdict['category'] not in ('receive', 'generate', 'immature'):
+def process_deposite_transactions(txdicts, ticker, current_block=None):
+    """Ingest a batch of ``listsinceblock``/``gettransaction`` entries.
+
+    Involved addresses, wallets and transactions are loaded with one query
+    each, wallets are locked in id order and every wallet gets a single
+    aggregated balance update. Entries are applied in order, so repeated
+    (txid, address) pairs behave as they would with one call per entry.
+
+    Unconfirmed deposits remember the block they were mined in, so
+    ``query_transactions`` can confirm them by height later on.
+    """
+    txdicts = [t for t in txdicts if t['category'] in DEPOSITE_CATEGORIES]
+    if not txdicts:
         return
 
-    try:
-        address = Address.objects.select_for_update().get(address=txdict['address'])
-    except Address.DoesNotExist:
+    # Locked in a fixed order, walletnotify runs alongside the block scan
+    addresses = Address.objects.select_for_update().order_by('address') \
+        .in_bulk({t['address'] for t in txdicts})
+    txdicts = [t for t in txdicts if t['address'] in addresses]
+    if not txdicts:
         return
 
     currency = Currency.objects.get(ticker=ticker)
 
-    try:
-        wallet = Wallet.objects.select_for_update().get(addresses=address)
-    except Wallet.DoesNotExist:
-        wallet, created = Wallet.objects.select_for_update().get_or_create(
+    orphans = [a for a in addresses.values() if a.wallet_id is None]
+    if orphans:
+        unknown, created = Wallet.objects.get_or_create(
             currency=currency,
             label='_unknown_wallet'
         )
-        address.wallet = wallet
-        address.save()
-
-    tx, created = Transaction.objects.select_for_update().get_or_create(txid=txdict['txid'], address=txdict['address'], currency=currency)
+        Address.objects.filter(address__in=[a.address for a in orphans]).update(wallet=unknown)
+        for address in orphans:
+            address.wallet_id = unknown.id
+
+    # Sharded wallets aren't locked, each gets one of its shards locked instead
+    wallet_ids = {a.wallet_id for a in addresses.values()}
+    wallets = Wallet.objects.filter(id__in=wallet_ids, shards__gt=0).in_bulk()
+    wallets.update(Wallet.objects.select_for_update().order_by('id').in_bulk(wallet_ids - set(wallets)))
+
+    shards = {}
+    for txdict in txdicts:
+        wallet = wallets[addresses[txdict['address']].wallet_id]
+        if wallet.shards and wallet.id not in shards:
+            shards[wallet.id] = wallet.shard_index(txdict['txid'])
+    if shards:
+        shard_filter = Q()
+        for wallet_id, index in shards.items():
+            shard_filter |= Q(wallet_id=wallet_id, index=index)
+        list(WalletShard.objects.select_for_update().filter(shard_filter).order_by('wallet', 'index').values_list('id'))
+
+    txs = {}
+    for tx in Transaction.objects.select_for_update() \
+            .filter(txid__in={t['txid'] for t in txdicts}).order_by('id'):
+        txs[(tx.txid, tx.address)] = tx
+
+    new_txs = []
+    moved_txs = {}
+    confirmed_ids = []
+    operations = []
+    deltas = defaultdict(lambda: {'balance': Decimal('0'), 'unconfirmed': Decimal('0')})
+    touched = []
+
+    for txdict in txdicts:
+        key = (txdict['txid'], txdict['address'])
+        tx = txs.get(key)
+        created = tx is None
+        if created:
+            tx = txs[key] = Transaction(txid=txdict['txid'], address=txdict['address'], currency=currency)
+            new_txs.append(tx)
+
+        if tx.processed:
+            continue
 
-    if tx.processed:
-        return
+        block_height = get_block_height(txdict, current_block)
+        block_hash = txdict.get('blockhash') if block_height is not None else None
+        if created:
+            tx.amount = txdict['amount']
+        if (tx.block_height, tx.block_hash) != (block_height, block_hash):
+            tx.block_height = block_height
+            tx.block_hash = block_hash
+            if not created:
+                moved_txs[key] = tx
+
+        wallet_id = addresses[txdict['address']].wallet_id
+        confirmed = txdict['confirmations'] >= settings.CC_CONFIRMATIONS and txdict['category'] != 'immature'
+        amount = txdict['amount']
+
+        if created:
+            if confirmed:
+                operations.append((key, Operation(wallet_id=wallet_id, balance=amount, description='Deposite')))
+                deltas[wallet_id]['balance'] += amount
+                tx.processed = True
+            else:
+                operations.append((key, Operation(wallet_id=wallet_id, unconfirmed=amount, description='Unconfirmed')))
+                deltas[wallet_id]['unconfirmed'] += amount
 
-    if created:
-        if txdict['confirmations'] >= settings.CC_CONFIRMATIONS and txdict['category'] != 'immature':
-            Operation.objects.create(
-                wallet=wallet,
-                balance=txdict['amount'],
-                description='Deposite',
-                reason=tx
-            )
-            wallet.balance += txdict['amount']
-            wallet.save()
+        elif confirmed:
+            operations.append((key, Operation(wallet_id=wallet_id, unconfirmed=-amount, balance=amount, description='Confirmed')))
+            deltas[wallet_id]['unconfirmed'] -= amount
+            deltas[wallet_id]['balance'] += amount
             tx.processed = True
-        else:
-            Operation.objects.create(
-                wallet=wallet,
-                unconfirmed=txdict['amount'],
-                description='Unconfirmed',
-                reason=tx
+            if tx.pk:
+                confirmed_ids.append(tx.pk)
+
+        if wallet_id not in touched:
+            touched.append(wallet_id)
+
+    if new_txs:
+        Transaction.objects.bulk_create(new_txs)
+        if any(tx.pk is None for tx in new_txs):
+            # Backends that can't return ids from bulk inserts
+            for pk, txid, address in Transaction.objects \
+                    .filter(txid__in={tx.txid for tx in new_txs}) \
+                    .values_list('pk', 'txid', 'address'):
+                txs[(txid, address)].pk = pk
+
+    if moved_txs:
+        Transaction.objects.bulk_update(moved_txs.values(), ['block_height', 'block_hash'])
+
+    if confirmed_ids:
+        Transaction.objects.filter(pk__in=confirmed_ids).update(processed=True)
+
+    content_type = ContentType.objects.get_for_model(Transaction)
+    for key, op in operations:
+        op.reason_content_type = content_type
+        op.reason_object_id = txs[key].pk
+    Operation.objects.bulk_create([op for key, op in operations])
+
+    for wallet_id in sorted(deltas):
+        delta = deltas[wallet_id]
+        if wallet_id in shards:
+            updated = WalletShard.objects.filter(wallet_id=wallet_id, index=shards[wallet_id]).update(
+                balance=F('balance') + as_amount(delta['balance']),
+                unconfirmed=F('unconfirmed') + as_amount(delta['unconfirmed']),
             )
-            wallet.unconfirmed += txdict['amount']
-            wallet.save()
-
-    else:
-        if txdict['confirmations'] >= settings.CC_CONFIRMATIONS and txdict['category'] != 'immature':
-            Operation.objects.create(
-                wallet=wallet,
-                unconfirmed=-txdict['amount'],
-                balance=txdict['amount'],
-                description='Confirmed',
-                reason=tx
-            )
-            wallet.unconfirmed -= txdict['amount']
-            wallet.balance += txdict['amount']
-            wallet.save()
-            tx.processed = True
+            if not updated:
+                raise ValueError('Wallet {0} shard {1} is missing, use set_shards'.format(wallet_id, shards[wallet_id]))
+            continue
 
-    post_deposite.send(sender=process_deposite_transaction, instance=wallet)
-    tx.save()
+        Wallet.objects.filter(id=wallet_id).update(
+            balance=F('balance') + as_amount(delta['balance']),
+            unconfirmed=F('unconfirmed') + as_amount(delta['unconfirmed']),
+        )
+        wallets[wallet_id].balance += delta['balance']
+        wallets[wallet_id].unconfirmed += delta['unconfirmed']
+
+    for wallet_id in touched:
+        wallet = wallets[wallet_id]
+        if wallet.shards:
+            # Deposits went to a shard, the row alone doesn't show them
+            wallet.refresh_from_db(fields=SHARD_FIELDS)
+            balance = wallet.get_balance()
+        else:
+            balance = dict((k, getattr(wallet, k)) for k in SHARD_FIELDS)
+        post_deposite.send(sender=process_deposite_transaction, instance=wallet, balance=balance)
 
 
 @shared_task(throws=(socket_error,))
-@transaction.atomic
 def query_transaction(ticker, txid):
-    currency = Currency.objects.select_for_update().get(ticker=ticker)
-    coin = AuthServiceProxy(currency.api_url)
-    for txdict in normalise_txifno(coin.gettransaction(txid)):
-        process_deposite_transaction(txdict, ticker)
+    checks.require_amount_columns()
+    currency = Currency.objects.get(ticker=ticker)
+    coin = get_client(currency.api_url)
+    process_deposite_transactions(normalise_txifno(coin.gettransaction(txid)), ticker)
 
 
 def normalise_txifno(data):
@@ -128,98 +372,304 @@ def normalise_txifno(data):
         t['txid'] = data['txid']
         t['timereceived'] = data['timereceived']
         t['time'] = data['time']
+        for key in ('blockhash', 'blockheight'):
+            if key in data:
+                t[key] = data[key]
         arr.append(t)
     return arr
 
 
 @shared_task()
-def refill_addresses_queue():
-    for currency in Currency.objects.all():
-        coin = AuthServiceProxy(currency.api_url)
-        count = Address.objects.filter(currency=currency, active=True, wallet=None).count()
+def refill_addresses_queue(ticker=None):
+    """Top up the free addresses of a currency to its target pool size.
+
+    Without a ticker every currency is refilled by a task of its own.
+    Addresses are derived from ``Currency.xpub`` if it is set, otherwise
+    requested with batched ``getnewaddress`` calls. Returns the target, the
+    claim rate and how many addresses were created and how many failed.
+    """
+    if not ticker:
+        for c in Currency.objects.all():
+            refill_addresses_queue.delay(c.ticker)
+        return
+
+    currency = Currency.objects.get(ticker=ticker)
+    target = address_queue_target(currency)
+    report = {'ticker': ticker, 'created': 0, 'failed': 0, 'target': target, 'rate': currency.address_rate}
+    missing = target - Address.objects.filter(currency=currency, active=True, wallet=None).count()
+    unimported = Address.objects.filter(currency=currency, imported=False).count()
+    if missing <= 0 and not unimported:
+        return report
+
+    coin = get_client(currency.api_url)
+    if currency.xpub:
+        if missing > unimported:
+            derive_xpub_addresses(currency, coin, missing - unimported)
+        addresses = import_xpub_addresses(currency, coin, report)
+    else:
+        addresses = []
+        for calls in chunks([['getnewaddress', settings.CC_ACCOUNT] for i in range(missing)], settings.CC_RPC_BATCH_SIZE):
+            try:
+                addresses.extend(coin.batch(calls))
+            except (socket_error, CannotSendRequest, JSONRPCException) as e:
+                logger.warning('%s: %s getnewaddress calls failed: %s', ticker, len(calls), e)
+                report['failed'] += len(calls)
+        Address.objects.bulk_create([Address(address=a, currency=currency) for a in addresses])
+
+    report['created'] = len(addresses)
+    logger.info('%s: %s addresses created, %s calls failed', ticker, report['created'], report['failed'])
+    return report
+
+
+def address_queue_target(currency):
+    """Update the address claim rate of ``currency``, return the pool size to keep.
+
+    The rate is an exponentially weighted moving average of claims per
+    hour between refills, claims being the addresses that got a wallet
+    since the previous refill. A sample spanning ``CC_ADDRESS_REFILL_INTERVAL``
+    is weighted ``CC_ADDRESS_RATE_ALPHA`` and shorter ones less, so early
+    refills don't make it jump. The pool holds
+    ``CC_ADDRESS_QUEUE_HEADROOM`` refill intervals worth of claims, within
+    ``CC_ADDRESS_QUEUE`` and ``CC_ADDRESS_QUEUE_MAX``. An early refill is
+    queued once half of it has been claimed.
+    """
+    started = now()
+    assigned = Address.objects.filter(currency=currency).exclude(wallet=None).count()
+    claims = max(0, assigned - currency.address_assigned)
+
+    if currency.address_rate_updated and started > currency.address_rate_updated:
+        elapsed = (started - currency.address_rate_updated).total_seconds()
+        alpha = 1 - (1 - settings.CC_ADDRESS_RATE_ALPHA) ** (elapsed / settings.CC_ADDRESS_REFILL_INTERVAL)
+        currency.address_rate += alpha * (claims * 3600 / elapsed - currency.address_rate)
+
+    needed = currency.address_rate * settings.CC_ADDRESS_REFILL_INTERVAL / 3600 * settings.CC_ADDRESS_QUEUE_HEADROOM
+    target = int(min(settings.CC_ADDRESS_QUEUE_MAX, max(settings.CC_ADDRESS_QUEUE, math.ceil(needed))))
+    notify.schedule_refill(currency.ticker, max(1, target // 2))
+
+    currency.address_queue = target
+    currency.address_assigned = assigned
+    currency.address_rate_updated = started
+    Currency.objects.filter(ticker=currency.ticker).update(
+        address_rate=currency.address_rate,
+        address_queue=target,
+        address_assigned=assigned,
+        address_rate_updated=started,
+    )
+    logger.info('%s: %.1f address claims per hour, keeping %s free addresses', currency.ticker, currency.address_rate, target)
+    return target
+
+
+def derive_xpub_addresses(currency, coin, count):
+    """Derive ``count`` addresses from the currency xpub and store them unimported.
+
+    The derivation indexes are reserved in the same transaction the
+    addresses are stored in, so concurrent refills never derive the same
+    address and none is lost if importing it fails. Raises ValueError if
+    the node can't watch derived addresses.
+    """
+    hd.check_node(coin, currency.xpub, currency.magicbyte)
+    with transaction.atomic():
+        start = Currency.objects.select_for_update().values_list('xpub_index', flat=True).get(ticker=currency.ticker)
+        Address.objects.bulk_create([
+            Address(address=a, currency=currency, active=False, imported=False)
+            for a in hd.derive_addresses(currency.xpub, currency.magicbyte, start, count)
+        ])
+        Currency.objects.filter(ticker=currency.ticker).update(xpub_index=start + count)
+
+
+def import_xpub_addresses(currency, coin, report):
+    """Import the unimported addresses of ``currency`` watch-only.
+
+    Imported addresses join the pool, ones the node failed to import are
+    counted in ``report`` and retried by the next refill.
+    """
+    pending = Address.objects.filter(currency=currency, imported=False).order_by('created')
+    imported = []
+    for addresses in chunks(pending.values_list('address', flat=True), settings.CC_RPC_BATCH_SIZE):
+        requests = [{
+            'scriptPubKey': {'address': a},
+            'timestamp': 'now',
+            'watchonly': True,
+            'label': settings.CC_ACCOUNT,
+        } for a in addresses]
+        try:
+            results = coin.importmulti(requests, {'rescan': False})
+        except (socket_error, CannotSendRequest, JSONRPCException) as e:
+            logger.warning('%s: importing %s addresses failed: %s', currency.ticker, len(addresses), e)
+            report['failed'] += len(addresses)
+            continue
+
+        succeeded = []
+        for address, result in zip(addresses, results):
+            if result.get('success'):
+                succeeded.append(address)
+            else:
+                report['failed'] += 1
+        Address.objects.filter(address__in=succeeded).update(active=True, imported=True)
+        imported.extend(succeeded)
+
+    return imported
+
+
+@shared_task()
+def create_checkpoints(ticker=None):
+    checks.require_amount_columns()
+    wallets = Wallet.objects.all()
+    if ticker:
+        wallets = wallets.filter(currency__ticker=ticker)
+
+    for wallet in wallets.iterator():
+        wallet.create_checkpoint()
+
+
+@shared_task()
+def fold_wallet_shards():
+    checks.require_amount_columns()
+    for wallet in Wallet.objects.filter(shards__gt=0).iterator():
+        wallet.fold_shards()
+
 
-        if count < settings.CC_ADDRESS_QUEUE:
-            for i in range(count, settings.CC_ADDRESS_QUEUE):
-                try:
-                    Address.objects.create(address=coin.getnewaddress(settings.CC_ACCOUNT), currency=currency)
-                except (socket_error, CannotSendRequest) :
-                    pass
+@shared_task()
+def archive_operations(ticker=None):
+    checks.require_amount_columns()
+    before = now() - timedelta(days=settings.CC_ARCHIVE_AFTER)
+    wallets = Wallet.objects.filter(id__in=Operation.objects.filter(created__lt=before).values('wallet'))
+    if ticker:
+        wallets = wallets.filter(currency__ticker=ticker)
+
+    for wallet in wallets.iterator():
+        wallet.archive_operations(before)
 
 
 @shared_task()
 def process_withdraw_transactions(ticker=None):
+    checks.require_amount_columns()
     if not ticker:
         for c in Currency.objects.all():
             process_withdraw_transactions.delay(c.ticker)
         return
 
-    with transaction.atomic():
-        currency = Currency.objects.select_for_update().get(ticker=ticker)
-        coin = AuthServiceProxy(currency.api_url)
+    currency = Currency.objects.get(ticker=ticker)
+    with lease(currency, Lease.WITHDRAW) as token:
+        if token is not None:
+            return send_withdraw_transactions(currency, token)
+
+
+def split_outputs(outputs, max_outputs, max_amount=None):
+    """Split ``{address: amount}`` into dicts of at most ``max_outputs``
+    outputs and ``max_amount`` in total. An output above ``max_amount`` is
+    sent on its own."""
+    chunk, total = {}, Decimal('0')
+    for address, amount in outputs.items():
+        if chunk and (len(chunk) >= max_outputs or max_amount and total + amount > max_amount):
+            yield chunk
+            chunk, total = {}, Decimal('0')
+        chunk[address] = amount
+        total += amount
+    if chunk:
+        yield chunk
+
+
+def send_withdraw_transactions(currency, token):
+    """Send the new withdraw transactions of a currency.
+
+    They are paid by ``sendmany`` transactions of up to
+    ``CC_WITHDRAW_MAX_OUTPUTS`` outputs and ``Currency.withdraw_max_amount``
+    in total, sent by ``CC_WITHDRAW_CONCURRENCY`` threads. Every chunk is
+    settled on its own; withdrawals of a chunk that failed are left in the
+    ``ERROR`` state. Returns how many withdrawals were sent and how many
+    failed, and the txids.
+    """
+    coin = get_client(currency.api_url)
+    report = {'ticker': currency.ticker, 'sent': 0, 'failed': 0, 'txids': []}
+
+    # this will fail if bitcoin offline
+    coin.getbalance()
 
-        # this will fail if bitcoin offline
-        coin.getbalance()
+    with transaction.atomic():
+        Lease.fence(currency, Lease.WITHDRAW, token)
 
         wtxs = WithdrawTransaction.objects.select_for_update() \
-            .select_related('wallet') \
             .filter(currency=currency, state=WithdrawTransaction.NEW, txid=None) \
-            .order_by('wallet')
+            .order_by('wallet') \
+            .values_list('id', 'address', 'amount')
 
         transaction_hash = {}
-        for tx in wtxs:
-            if tx.address in transaction_hash:
-                transaction_hash[tx.address] += tx.amount
-            else:
-                transaction_hash[tx.address] = tx.amount
+        address_ids = defaultdict(list)
+        for wtx_id, address, amount in wtxs:
+            transaction_hash[address] = transaction_hash.get(address, Decimal('0')) + amount
+            address_ids[address].append(wtx_id)
 
         if currency.dust > Decimal('0'):
             for address, amount in list(transaction_hash.items()):
                 if amount < currency.dust:
-                    wtxs = wtxs.exclude(currency=currency, address=address)
                     del transaction_hash[address]
 
         if not transaction_hash:
-            return
+            return report
 
-        wtxs_ids = list(wtxs.values_list('id', flat=True))
-        wtxs.update(state=WithdrawTransaction.ERROR)
+        batches = [
+            (outputs, [wtx_id for address in outputs for wtx_id in address_ids[address]])
+            for outputs in split_outputs(transaction_hash, settings.CC_WITHDRAW_MAX_OUTPUTS, currency.withdraw_max_amount)
+        ]
+        WithdrawTransaction.objects.filter(id__in=[wtx_id for outputs, ids in batches for wtx_id in ids]) \
+            .update(state=WithdrawTransaction.ERROR)
 
     # this will fail if bitcoin offline
     coin.getbalance()
 
-    txid = coin.sendmany(settings.CC_ACCOUNT, transaction_hash)
-
-    if not txid:
-        raise AssertionError('txid is empty')
-
-    fee = coin.gettransaction(txid).get('fee', 0) * -1
+    def sendmany(outputs):
+        txid = coin.sendmany(settings.CC_ACCOUNT, outputs)
+        if not txid:
+            raise AssertionError('txid is empty')
+        return txid, coin.gettransaction(txid).get('fee', 0) * -1
+
+    # Only the node calls run in threads, settlement stays on this connection
+    with ThreadPoolExecutor(max_workers=settings.CC_WITHDRAW_CONCURRENCY) as executor:
+        futures = dict((executor.submit(sendmany, outputs), ids) for outputs, ids in batches)
+        for future in as_completed(futures):
+            ids = futures[future]
+            try:
+                txid, fee = future.result()
+            except (socket_error, CannotSendRequest, JSONRPCException, AssertionError) as e:
+                logger.error('%s: sendmany of %s withdrawals failed: %s', currency.ticker, len(ids), e)
+                report['failed'] += len(ids)
+                continue
+
+            settle_withdraw_transactions(ids, txid, fee)
+            report['sent'] += len(ids)
+            report['txids'].append(txid)
+
+    logger.info('%s: %s withdrawals sent in %s transactions, %s failed',
+                currency.ticker, report['sent'], len(report['txids']), report['failed'])
+    return report
+
+
+def settle_withdraw_transactions(wtxs_ids, txid, fee):
+    """Mark withdraw transactions paid by ``txid``, splitting ``fee`` evenly"""
+    fee_per_tx = fee / len(wtxs_ids) if fee else 0
 
     with transaction.atomic():
-        currency = Currency.objects.select_for_update().get(ticker=ticker)
-        wtxs = WithdrawTransaction.objects.select_for_update().filter(id__in=wtxs_ids)
-        if not fee:
-            fee_per_tx = 0
-        else:
-            fee_per_tx = (fee / len(wtxs))
-
-        fee_hash = defaultdict(lambda : {'fee': Decimal('0'), 'amount': Decimal('0')})
-
-        for tx in wtxs:
-            fee_hash[tx.wallet]['fee'] += fee_per_tx
-            fee_hash[tx.wallet]['amount'] += tx.amount
-
-        for (wallet, data) in fee_hash.items():
-            Operation.objects.create(
-                wallet=wallet,
-                holded=-data['amount'],
-                balance=-data['fee'],
-                description='Network fee',
-                reason=tx
+        wtxs = WithdrawTransaction.objects.filter(id__in=wtxs_ids)
+        totals = wtxs.values('wallet').annotate(count=Count('id'), total=Sum('amount'), last=Max('id')).order_by('wallet')
+
+        content_type = ContentType.objects.get_for_model(WithdrawTransaction)
+        operations = []
+        for row in totals:
+            wallet_fee = fee_per_tx * row['count']
+            # Wallets first and in id order, they are what checkpoints lock
+            Wallet.objects.filter(id=row['wallet']).update(
+                balance=F('balance') - as_amount(wallet_fee),
+                holded=F('holded') - as_amount(row['total']),
             )
-
-            wallet = Wallet.objects.get(id=tx.wallet.id)
-            wallet.balance -= data['fee']
-            wallet.holded -= data['amount']
-            wallet.save()
+            operations.append(Operation(
+                wallet_id=row['wallet'],
+                holded=-row['total'],
+                balance=-wallet_fee,
+                description='Network fee',
+                reason_content_type=content_type,
+                reason_object_id=row['last'],
+            ))
+        Operation.objects.bulk_create(operations)
 
         wtxs.update(txid=txid, fee=fee_per_tx, state=WithdrawTransaction.DONE)
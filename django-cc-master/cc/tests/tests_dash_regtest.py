@@ -39,7 +39,7 @@ class WalletAddressGet(TransactionTestCase):
 
     def setUp(self):
         self.currency = Currency.objects.create(label='Dash regtest', ticker='tdsh', api_url=URL, magicbyte='140')
-        tasks.refill_addresses_queue()
+        tasks.refill_addresses_queue('tdsh')
 
     def test_address_refill(self):
         wallet = Wallet.objects.create(currency=self.currency)
@@ -0,0 +1,97 @@
+from io import StringIO
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from pycoin.symbols.btc import network as BTC
+
+from cc.fakenode import FakeNode
+from cc.models import Wallet, Address, Currency, Operation, Transaction, WithdrawTransaction
+from cc import tasks
+from cc import settings
+
+
+settings.CC_CONFIRMATIONS = 2
+settings.CC_ACCOUNT = ''
+
+
+class FakeNodeTestCase(TransactionTestCase):
+    def setUp(self):
+        self.node = FakeNode().start()
+        self.currency = Currency.objects.create(label='Fake', ticker='fake', api_url=self.node.url, magicbyte='111,196')
+
+    def tearDown(self):
+        self.node.stop()
+
+
+class Deposit(FakeNodeTestCase):
+    def test_deposit(self):
+        tasks.refill_addresses_queue('fake')
+        wallet = Wallet.objects.create(currency=self.currency)
+        address = wallet.get_address().address
+
+        self.node.deposit(address, Decimal('1'))
+        tasks.query_transactions('fake')
+        wallet = Wallet.objects.get(id=wallet.id)
+        self.assertEqual(wallet.unconfirmed, Decimal('1'))
+
+        self.node.generate(1)
+        tasks.query_transactions('fake')
+        wallet = Wallet.objects.get(id=wallet.id)
+        self.assertEqual(wallet.unconfirmed, Decimal('1'))
+        self.assertEqual(wallet.balance, Decimal('0'))
+
+        self.node.generate(1)
+        tasks.query_transactions('fake')
+        wallet = Wallet.objects.get(id=wallet.id)
+        self.assertEqual(wallet.unconfirmed, Decimal('0'))
+        self.assertEqual(wallet.balance, Decimal('1'))
+
+    def test_xpub_deposit(self):
+        Currency.objects.filter(ticker='fake').update(xpub=BTC.keys.bip32_seed(b'fake').public_copy().hwif())
+        report = tasks.refill_addresses_queue('fake')
+        self.assertEqual(report['created'], settings.CC_ADDRESS_QUEUE)
+        self.assertEqual(sorted(self.node.addresses), sorted(Address.objects.values_list('address', flat=True)))
+
+        wallet = Wallet.objects.create(currency=self.currency)
+        self.node.deposit(wallet.get_address().address, Decimal('1'))
+        tasks.query_transactions('fake')
+        self.assertEqual(Wallet.objects.get(id=wallet.id).unconfirmed, Decimal('1'))
+
+    def test_synthesize_block(self):
+        wallets = [Wallet.objects.create(currency=self.currency) for i in range(3)]
+        addresses = [Address.objects.create(address=self.node.new_address(), currency=self.currency, wallet=w).address
+                     for w in wallets]
+
+        self.node.synthesize_block(30, addresses, Decimal('0.1'))
+        self.node.generate(1)
+        tasks.query_transactions('fake')
+
+        for wallet in wallets:
+            self.assertEqual(Wallet.objects.get(id=wallet.id).balance, Decimal('1'))
+        self.assertEqual(Transaction.objects.filter(processed=True).count(), 30)
+
+
+class Withdraw(FakeNodeTestCase):
+    def test_withdraw(self):
+        wallet = Wallet.objects.create(currency=self.currency, balance=Decimal('1'))
+        wallet.withdraw_to_address(self.node.new_address(), Decimal('0.4'))
+        wallet.withdraw_to_address(self.node.new_address(), Decimal('0.5'))
+
+        tasks.process_withdraw_transactions('fake')
+
+        wallet = Wallet.objects.get(id=wallet.id)
+        self.assertEqual(wallet.balance, Decimal('0.1') - self.node.fee)
+        self.assertEqual(wallet.holded, Decimal('0'))
+        self.assertFalse(WithdrawTransaction.objects.exclude(state=WithdrawTransaction.DONE).exists())
+
+
+class Benchmark(TransactionTestCase):
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark', wallets=5, blocks=2, deposits=20, withdrawals=10, stdout=out)
+
+        self.assertIn('query_transactions', out.getvalue())
+        self.assertIn('process_withdraw_transactions', out.getvalue())
+        self.assertFalse(Currency.objects.exists())
+        self.assertFalse(Operation.objects.exists())
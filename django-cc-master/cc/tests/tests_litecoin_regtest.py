@@ -39,7 +39,7 @@ class WalletAddressGet(TransactionTestCase):
 
     def setUp(self):
         self.currency = Currency.objects.create(label='Litecoin regtest', ticker='tbtc', api_url=URL, magicbyte='58')
-        tasks.refill_addresses_queue()
+        tasks.refill_addresses_queue('tbtc')
 
     def test_address_refill(self):
         wallet = Wallet.objects.create(currency=self.currency)
@@ -39,7 +39,7 @@ class WalletAddressGet(TransactionTestCase):
 
     def setUp(self):
         self.currency = Currency.objects.create(label='Zcash regtest', ticker='tzec', api_url=URL, magicbyte='29')
-        tasks.refill_addresses_queue()
+        tasks.refill_addresses_queue('tzec')
 
     def wait_for_operation(self, operation):
         waiting = True
@@ -1,9 +1,58 @@
+import os
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
 from pycoin.encoding.b58 import a2b_hashed_base58
 from pycoin.encoding.exceptions import EncodingError
 
+from cc import settings
+
+
+class Validator(object):
+	"""Address validator for one ``Currency.magicbyte`` string.
+
+	Results of ``validate`` are cached, ``validate_many`` spreads big
+	batches over a process pool.
+	"""
+
+	def __init__(self, magic_bytes, cache_size=None):
+		self.magic_bytes = magic_bytes
+		self.prefixes = bytes(map(int, magic_bytes.split(',')))
+		self.validate = lru_cache(maxsize=cache_size or settings.CC_VALIDATOR_CACHE)(self._validate)
+
+	def _validate(self, address):
+		try:
+			return a2b_hashed_base58(address)[:1] in self.prefixes
+		except EncodingError:
+			return False
+
+	def validate_many(self, addresses, processes=None):
+		addresses = list(addresses)
+		if len(addresses) < settings.CC_VALIDATOR_POOL_THRESHOLD:
+			return [self.validate(a) for a in addresses]
+
+		processes = processes or settings.CC_VALIDATOR_PROCESSES or os.cpu_count() or 1
+		size = len(addresses) // processes + 1
+		chunks = [addresses[i:i + size] for i in range(0, len(addresses), size)]
+		with ProcessPoolExecutor(processes) as pool:
+			results = pool.map(_validate_chunk, [self.magic_bytes] * len(chunks), chunks)
+			return [valid for chunk in results for valid in chunk]
+
+
+def _validate_chunk(magic_bytes, addresses):
+	validator = get_validator(magic_bytes)
+	return [validator.validate(a) for a in addresses]
+
+
+_validators = {}
+
+
+def get_validator(magic_bytes):
+	"""Return the per-process ``Validator`` for ``magic_bytes``"""
+	if magic_bytes not in _validators:
+		_validators[magic_bytes] = Validator(magic_bytes)
+	return _validators[magic_bytes]
+
 
 def validate(address, magic_bytes):
-	try:
-		return a2b_hashed_base58(address)[:1] in bytes(map(int, magic_bytes.split(',')))
-	except EncodingError:
-		return False
+	return get_validator(magic_bytes).validate(address)
@@ -4,6 +4,7 @@ from django.http import HttpResponse, HttpResponseForbidden, HttpResponseBadRequ
 from django.http.request import validate_host, split_domain_port
 
 from . import settings
+from . import notify
 from .models import Currency
 from .tasks import query_transactions, query_transaction
 
@@ -48,7 +49,8 @@ def vaidate_txid(func):
 @cc_validate_host
 @vaidate_currency
 def blocknotify(request):
-    query_transactions.delay(ticker=request.GET['currency'])
+    if notify.schedule_scan(request.GET['currency']):
+        query_transactions.delay(ticker=request.GET['currency'])
     return HttpResponse('success')
 
 
@@ -56,5 +58,6 @@ def blocknotify(request):
 @vaidate_currency
 @vaidate_txid
 def walletnotify(request):
-    query_transaction.delay(request.GET['currency'], request.GET['txid'])
+    if notify.schedule_txid(request.GET['currency'], request.GET['txid']):
+        query_transaction.delay(request.GET['currency'], request.GET['txid'])
     return HttpResponse('success')
@@ -21,7 +21,7 @@ setup(
     download_url = 'https://github.com/limpbrains/django-cc/tarball/0.2.3',
     install_requires=[
         'celery>=3',
-        'Django>=1.7',
+        'Django>=2.2',
         'mock',
         'pycoin>=0.90',
         'python-bitcoinrpc>=1.0',